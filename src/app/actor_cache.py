@@ -0,0 +1,126 @@
+"""Two tier cache of remote actor documents
+
+Fresh entries are served from an in-process LRU, then from the remote_actors table.
+Stale entries are revalidated with a conditional GET using the stored ETag and
+Last-Modified, so an unchanged actor costs a 304 instead of a full download.
+"""
+import asyncio
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+import httpx
+from sqlalchemy.dialects.postgresql import insert
+
+from app import http_client
+from app.cache import TTLCache
+from app.common import get_config
+from app.db import RemoteActor, SessionLocal
+
+config = get_config()
+CACHE_CONFIG = config.get("cache", None) or {}
+
+ACTOR_TTL = CACHE_CONFIG.get("actor_ttl", 3600)
+ACTOR_MEMORY_SIZE = CACHE_CONFIG.get("actor_memory_size", 5000)
+
+ACTIVITY_JSON_HEADERS = {
+    'Accept': 'application/activity+json',
+}
+
+_memory = TTLCache(ACTOR_MEMORY_SIZE, ACTOR_TTL)
+
+
+def _remaining_ttl(fetched_at: datetime) -> float:
+    return ACTOR_TTL - (datetime.utcnow() - fetched_at).total_seconds()
+
+
+def _store(db, url: str, data: Dict[str, Any], etag: Optional[str], last_modified: Optional[str]) -> None:
+    now = datetime.utcnow()
+    values = {
+        "url": url,
+        "data": data,
+        "fetched_at": now,
+        "etag": etag,
+        "last_modified": last_modified,
+    }
+    statement = insert(RemoteActor).values(**values)
+    statement = statement.on_conflict_do_update(
+        index_elements=[RemoteActor.url],
+        set_={key: value for key, value in values.items() if key != "url"},
+    )
+    db.execute(statement)
+    db.commit()
+
+
+def get_actor(url: str, refresh: bool = False) -> Optional[Dict[str, Any]]:
+    """Returns the actor document at url, going to the network only when the cached copy is stale
+
+    Args:
+        url (str): The actor url
+        refresh (bool): Revalidate with the remote server even if the cached copy is fresh
+
+    Returns:
+        Optional[Dict[str, Any]]: The actor document, None on an error response or if it could not be decoded
+    """
+    if not refresh:
+        data = _memory.get(url)
+        if data is not None:
+            return data
+
+    db = SessionLocal()
+    try:
+        row = db.get(RemoteActor, url)
+        if row is not None and not refresh and _remaining_ttl(row.fetched_at) > 0:
+            _memory.set(url, row.data, _remaining_ttl(row.fetched_at))
+            return row.data
+
+        headers = dict(ACTIVITY_JSON_HEADERS)
+        if row is not None:
+            if row.etag is not None:
+                headers["If-None-Match"] = row.etag
+            if row.last_modified is not None:
+                headers["If-Modified-Since"] = row.last_modified
+
+        try:
+            r = http_client.get(url, headers=headers)
+        except httpx.HTTPError as e:
+            if row is None:
+                raise
+            print(f"Error: failed to revalidate {url}, serving stale copy: {e}")
+            return row.data
+
+        if r.status_code == 304 and row is not None:
+            row.fetched_at = datetime.utcnow()
+            db.commit()
+            _memory.set(url, row.data)
+            return row.data
+
+        # An error document is not the actor
+        if r.status_code >= 400:
+            print(f"Error: got {r.status_code} for {url}")
+            return None
+
+        try:
+            data = r.json()
+        except ValueError:
+            print("Error, failed to decode: " + str(url))
+            return None
+
+        _store(db, url, data, r.headers.get("etag"), r.headers.get("last-modified"))
+        _memory.set(url, data)
+        return data
+    finally:
+        db.close()
+
+
+async def get_actor_async(url: str, refresh: bool = False) -> Optional[Dict[str, Any]]:
+    """Same as get_actor, answers fresh entries from memory without leaving the event loop"""
+    if not refresh:
+        data = _memory.get(url)
+        if data is not None:
+            return data
+    return await asyncio.to_thread(get_actor, url, refresh)
+
+
+def invalidate(url: str) -> None:
+    """Drops the in-process copy so the next read goes back to the database or network"""
+    _memory.pop(url)
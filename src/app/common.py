@@ -1,7 +1,9 @@
 import os
 import re
 import yaml
+import base64
 import inspect
+from datetime import datetime
 from typing import Type, Tuple
 from urllib.parse import urljoin, quote_plus, urlparse
 
@@ -60,6 +62,18 @@ def as_form(cls: Type[BaseModel]):
 def get_group_path(group) -> str:
     return SERVER_URL + "/group/" + group
 
+def get_context():
+    return ["https://www.w3.org/ns/activitystreams",
+    SERVER_URL + "/static/schemas/litepub-0.1.jsonld",
+    {
+        "@language":"und"
+    }]
+
+def get_default_gpg_private_key_path():
+    default_gpg_path = os.path.join(config["main"]["data_folder"], "default_gpg_key")
+    private_default_gpg_path = os.path.join(default_gpg_path, "id_rsa")
+    return private_default_gpg_path
+
 def datetime_str(date_time) -> str:
     return_value = date_time.isoformat().replace("+00:00", "Z")
     if not return_value.endswith("Z"):
@@ -67,6 +81,24 @@ def datetime_str(date_time) -> str:
     return return_value
 
 
+def encode_cursor(created_at: datetime, id: int) -> str:
+    """Opaque cursor pointing after a row of a (created_at, id) ordered listing"""
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{id}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Reverse of encode_cursor
+
+    Raises:
+        ValueError: If the cursor is not one we made
+    """
+    try:
+        created_at, id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(id)
+    except ValueError as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
 def multi_urljoin(*parts) -> str:
     """Joins url strings together with escapes for arguments
 
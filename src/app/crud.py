@@ -7,24 +7,40 @@ from typing import List, Optional, Dict, Any, Tuple
 import copy
 from datetime import datetime
 import uuid
+import httpx
 from sqlmodel import select, Session
+from sqlalchemy import func, distinct, or_, and_, insert, tuple_, delete
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, selectinload
+from sqlmodel.ext.asyncio.session import AsyncSession
 from app.schemas import GroupCreate, MemberCreateRemove, ActorCreateRemove, OauthAppCreateRemove,\
  NoteCreate, BoostCreate
 from app.db import Group, Members, Actor, Note, Boost, RecipientType, NoteRecipients, BoostRecipients, \
-OauthApp, OauthCode, Setting
-from app.common import SERVER_URL, datetime_str
-
-from app.get_federated_data import get_profile, actor_to_address_format, get_actor_url, get_federated_note
+OauthApp, OauthCode, Setting, HomeTimeline
+from app.common import SERVER_URL, datetime_str, get_config
+
+from app.get_federated_data import get_profile, actor_to_address_format, get_actor_url, get_federated_note, \
+inbox_from_profile, shared_inbox_from_profile
+from app.recipients import classify_recipients, ACTOR
+from app.thread_resolver import resolve_ancestors, prefetch_authors
+from app.followers import invalidate_followers
 from app.mastodonapi import register_oauth_application, generate_oauth_state
 
-MAX_RECURSION_DEPTH = 10
-
 # CRUD comes from: Create, Read, Update, and Delete.
 
+config = get_config()
+TIMELINE_CONFIG = config.get("timeline", None) or {}
+
+PAGE_SIZE = TIMELINE_CONFIG.get("page_size", 20)
+
 
 def get_group_by_name(db: Session, name: str) -> Optional[Group]:
     return db.exec(select(Group).where(Group.name == name)).first()
 
+async def get_group_by_name_async(db: AsyncSession, name: str) -> Optional[Group]:
+    return (await db.exec(select(Group).where(Group.name == name))).first()
+
 def get_groups(db: Session) -> Optional[Group]:
     return db.exec(select(Group)).all()
 
@@ -38,66 +54,69 @@ def create_group(db: Session, item: GroupCreate) -> Group:
     return db_item
 
 
-def create_recipients_list(db, recipients: List[str], recipients_type: RecipientType) -> List[NoteRecipients]:
-    print("create_recipients_list")
-    recipients_add = []
-    for recipient in recipients:
-        recipient_to_add = {
-            "type": recipients_type,
-            "url": recipient
-        }
-
-        if "https://www.w3.org/ns/activitystreams" not in recipient:
-            profile = get_profile(recipient)
-            if profile is not None and "type" in profile.keys() and not "Collection" in profile["type"]:
-                # This is an actor, lets store this as a mention
-                recipient_to_add["actor"] = get_handle_from_url_or_create(
-                    db, recipient)
-
-        recipients_add.append(NoteRecipients(**recipient_to_add))
-
-    return recipients_add
+def recipient_entries(db: Session, recipients: List[str], recipients_type: RecipientType) -> List[Dict[str, Any]]:
+    """Fields of the recipient rows of a note, recipients that are actors get linked to their Actor"""
+    kinds = classify_recipients(recipients)
+    actor_urls = [recipient for recipient in recipients if kinds[recipient] == ACTOR]
+    actors = {}
+    if len(actor_urls) > 0:
+        for actor in db.exec(select(Actor).where(Actor.uri.in_(actor_urls))).all():
+            actors[actor.uri] = actor
 
-
-def create_boost_recipients_list(db, recipients: List[str], recipients_type: RecipientType) -> List[BoostRecipients]:
-    print("create_recipients_list")
-    recipients_add = []
+    entries = []
     for recipient in recipients:
         recipient_to_add = {
             "type": recipients_type,
             "url": recipient
         }
 
-        if "https://www.w3.org/ns/activitystreams" not in recipient:
-            profile = get_profile(recipient)
-            if profile is not None and "type" in profile.keys() and not "Collection" in profile["type"]:
-                # This is an actor, lets store this as a mention
-                recipient_to_add["actor"] = get_handle_from_url_or_create(
-                    db, recipient)
-
-        recipients_add.append(BoostRecipients(**recipient_to_add))
-
-    return recipients_add
-
-def create_internal_note(db: Session, item: NoteCreate) -> Note:
-    item["created_at"] = datetime.utcnow()
-
-    cc = create_recipients_list(db, item["cc"], RecipientType.cc)
-    to = create_recipients_list(db, item["to"], RecipientType.to)
-
-    item["recipients"] = cc + to
+        if kinds[recipient] == ACTOR:
+            # This is an actor, lets store this as a mention
+            actor = actors.get(recipient, None)
+            if actor is None:
+                actor = get_handle_from_url_or_create(db, recipient)
+            recipient_to_add["actor"] = actor
+
+        entries.append(recipient_to_add)
+    return entries
+
+
+def recipient_rows(db: Session, item: Dict[str, Any], parent_key: str, parent_id: Optional[int]) -> List[Dict[str, Any]]:
+    """Recipient rows of a note or boost, ready for a bulk insert"""
+    entries = recipient_entries(db, item["cc"], RecipientType.cc) + recipient_entries(db, item["to"], RecipientType.to)
+    return [{
+        parent_key: parent_id,
+        "url": entry["url"],
+        "type": entry["type"],
+        "actor_id": entry["actor"].id if entry.get("actor", None) is not None else None,
+    } for entry in entries]
+
+
+def insert_rows(db: Session, model, rows: List[Dict[str, Any]]) -> None:
+    """One multi-row insert, the caller commits"""
+    if len(rows) > 0:
+        db.execute(insert(model).values(rows))
+
+def add_note_with_recipients(db: Session, item: NoteCreate, commit: bool = True) -> Note:
+    """Insert a note and all its recipients in one transaction"""
+    # Resolving recipients may create actors, which commit, so it comes first
+    rows = recipient_rows(db, item, "note_id", None)
     db_note_item = Note(**item)
-
     db.add(db_note_item)
-    db.commit()
-    db.refresh(db_note_item)
+    db.flush()
+
+    for row in rows:
+        row["note_id"] = db_note_item.id
+    insert_rows(db, NoteRecipients, rows)
+    if commit:
+        db.commit()
     return db_note_item
 
-def create_federated_note(db: Session, item: NoteCreate) -> Note:
-    cc = create_recipients_list(db, item["cc"], RecipientType.cc)
-    to = create_recipients_list(db, item["to"], RecipientType.to)
-    item["recipients"] = cc + to
+def create_internal_note(db: Session, item: NoteCreate, commit: bool = True) -> Note:
+    item["created_at"] = datetime.utcnow()
+    return add_note_with_recipients(db, item, commit)
 
+def create_federated_note(db: Session, item: NoteCreate, commit: bool = True) -> Note:
     item = copy.copy(item)
 
     if "attributedTo" not in item.keys():
@@ -113,48 +132,145 @@ def create_federated_note(db: Session, item: NoteCreate) -> Note:
     if type(item["attributedTo"]) == str:
         item["attributed"] = get_handle_from_url_or_create(db, item["attributedTo"])
 
-    db_note_item = Note(**item)
+    return add_note_with_recipients(db, item, commit)
 
-    db.add(db_note_item)
-    db.commit()
-    db.refresh(db_note_item)
-    return db_note_item
 
+def boost_fields_from_note(db: Session, note_url: str, federated_note_data: Dict[str, Any],
+                           original_poster: Optional[Actor] = None) -> Dict[str, Any]:
+    """The Boost columns taken from the note being boosted
 
-def get_note_from_url_or_create(db: Session, note_federated_id: str, depth=0) -> Boost:
-    if note_federated_id is None or depth > MAX_RECURSION_DEPTH:
-        return
-    federated_note_data = get_boost_by_note_id(db, note_federated_id)
-    if federated_note_data is not None:
-        return federated_note_data
-    return create_boost(note_federated_id, depth + 1)
+    Only what we list and search on is copied, source and attachment are read from the stored remote object.
+    """
+    if original_poster is None:
+        original_poster = get_handle_from_url_or_create(db, federated_note_data.get("attributedTo", None))
+    return {
+        "content": federated_note_data.get("content", ""),
+        "original_poster": original_poster,
+        "original_time": federated_note_data.get("published", None),
+        "summary": federated_note_data.get("summary", ""),
+        "remote_object_id": note_url,
+    }
 
-def create_boost(db: Session, item: BoostCreate, depth=0) -> Boost:
-    item["created_at"] = datetime.utcnow()
+def add_ancestor_boosts(db: Session, in_reply_to: Optional[str], item: BoostCreate) -> Optional[int]:
+    """Add the missing ancestors of a reply to the session, the caller commits
 
-    cc = create_boost_recipients_list(db, item["cc"], RecipientType.cc)
-    to = create_boost_recipients_list(db, item["to"], RecipientType.to)
+    Args:
+        db (Session): the db session
+        in_reply_to (Optional[str]): The inReplyTo of the note being boosted
+        item (BoostCreate): The boost being created, ancestors get its group and attributed actor
 
-    item["recipients"] = cc + to
+    Returns:
+        Optional[int]: The id of the boost the reply should point to, None if there is none
+    """
+    anchor, ancestors = resolve_ancestors(db, in_reply_to)
+    parent_id = anchor.id if anchor is not None else None
+    if len(ancestors) == 0:
+        return parent_id
+
+    # Actors are committed as they are created, get them all before adding any boost
+    prefetch_authors([data for _, data in ancestors])
+    authors = {}
+    for _, data in ancestors:
+        if data["attributedTo"] not in authors:
+            authors[data["attributedTo"]] = get_handle_from_url_or_create(db, data["attributedTo"])
+
+    now = datetime.utcnow()
+    # Oldest first so each one can point to its parent
+    for url, data in reversed(ancestors):
+        ancestor = Boost(
+            group=item["group"],
+            attributed=item["attributed"],
+            created_at=now,
+            note_id=url,
+            sensitive=item.get("sensitive", False),
+            in_reply_to_id=parent_id,
+            **boost_fields_from_note(db, url, data, authors[data["attributedTo"]]),
+        )
+        db.add(ancestor)
+        db.flush()
+        if ancestor.in_reply_to_id is None:
+            add_to_home_timelines(db, [ancestor.id])
+        parent_id = ancestor.id
+    print(f"Added {len(ancestors)} ancestors of {in_reply_to}")
+    return parent_id
+
+def create_boost(db: Session, item: BoostCreate) -> Boost:
+    return create_boosts(db, [item])[0]
+
+def boost_row(item: BoostCreate) -> Dict[str, Any]:
+    """A boost as the columns of a bulk insert"""
+    return {
+        "group_id": item["group"].id if item.get("group", None) is not None else None,
+        "attributed_id": item["attributed"].id,
+        "original_poster_id": item["original_poster"].id if item.get("original_poster", None) is not None else None,
+        "content": item["content"],
+        "note_id": item["note_id"],
+        "remote_object_id": item.get("remote_object_id", None),
+        "in_reply_to_id": item.get("in_reply_to_id", None),
+        "original_time": item["original_time"],
+        "summary": item.get("summary", None),
+        "created_at": item["created_at"],
+        "sensitive": item.get("sensitive", True),
+    }
 
-    federated_note_data = get_federated_note(item["note_id"])
-    item["content"] = federated_note_data.get("content", "")
-    item["original_poster"] =  get_handle_from_url_or_create(db, federated_note_data.get("attributedTo", None))
-    in_reply_to = get_note_from_url_or_create(db, federated_note_data.get("inReplyTo", None), depth)
-    item["in_reply_to_id"] = None
-    if in_reply_to is not None:
-        item["in_reply_to_id"] =  in_reply_to.id
-    item["original_time"] =  federated_note_data.get("published", None)
-    item["source"] = federated_note_data.get("source", "")
-    item["summary"] = federated_note_data.get("summary", "")
-    item["attachment"] = federated_note_data.get("attachment", [])
+def create_boosts(db: Session, items: List[BoostCreate], federated_note_data: Optional[Dict[str, Any]] = None,
+                  commit: bool = True) -> List[Boost]:
+    """Create the boosts of one note for several groups
 
-    db_boost_item = Boost(**item)
+    The note is fetched and its author and ancestors resolved once for all the groups.
+    The boosts are written with one multi-row insert, their recipients with another,
+    in one transaction.
 
-    db.add(db_boost_item)
-    db.commit()
-    db.refresh(db_boost_item)
-    return db_boost_item
+    Args:
+        db (Session): the db session
+        items (List[BoostCreate]): One boost per group, all of the same note_id
+        federated_note_data (Optional[Dict[str, Any]]): The note if the caller already fetched it
+        commit (bool): Commit when done, pass False to commit several activities together
+
+    Returns:
+        List[Boost]: The created boosts, in the order of items
+    """
+    if len(items) == 0:
+        return []
+    note_id = items[0]["note_id"]
+    if federated_note_data is None:
+        federated_note_data = get_federated_note(note_id)
+    note_fields = boost_fields_from_note(db, note_id, federated_note_data)
+
+    # Recipients may create actors, which commit, so they are resolved before anything is written
+    now = datetime.utcnow()
+    recipients = []
+    for item in items:
+        item["created_at"] = now
+        recipients.append(recipient_rows(db, item, "boost_id", None))
+
+    # Missing ancestors are stored once, under the first group
+    in_reply_to_id = add_ancestor_boosts(db, federated_note_data.get("inReplyTo", None), items[0])
+
+    rows = []
+    for item in items:
+        item.update(note_fields)
+        item["in_reply_to_id"] = in_reply_to_id
+        rows.append(boost_row(item))
+    # RETURNING is not promised to keep the order of VALUES, rows are matched back by group,
+    # each group boosts a note once
+    returned = db.execute(insert(Boost).values(rows).returning(Boost.id, Boost.group_id)).all()
+    boost_id_by_group = {group_id: boost_id for boost_id, group_id in returned}
+    boost_ids = [boost_id_by_group[row["group_id"]] for row in rows]
+
+    recipient_rows_all = []
+    for boost_id, boost_recipients in zip(boost_ids, recipients):
+        for row in boost_recipients:
+            row["boost_id"] = boost_id
+            recipient_rows_all.append(row)
+    insert_rows(db, BoostRecipients, recipient_rows_all)
+    if in_reply_to_id is None:
+        add_to_home_timelines(db, boost_ids)
+
+    if commit:
+        db.commit()
+    boosts = {boost.id: boost for boost in db.exec(select(Boost).where(Boost.id.in_(boost_ids))).all()}
+    return [boosts[boost_id] for boost_id in boost_ids]
     
 
 
@@ -173,7 +289,7 @@ def add_oauth_secret(db: Session, item: OauthAppCreateRemove) -> OauthApp:
     db.refresh(db_item)
     return db_item
 
-def get_actor_or_create(db: Session, actor_handle: str) -> Actor:
+def get_actor_or_create(db: Session, actor_handle: str, actor_url: Optional[str] = None) -> Actor:
     """
     The get_actor_or_create function takes in a database session and an actor@server format.
     It then checks if the actor exists in the database, and if it does not, creates a new entry for that actor.
@@ -181,6 +297,7 @@ def get_actor_or_create(db: Session, actor_handle: str) -> Actor:
     
     :param db:Session: Used to Connect to the database.
     :param actor_handle:str: Used to Get the actor if it exists.
+    :param actor_url:Optional[str]: The actor url if known, saves a webfinger lookup.
     :return: A db actor
     
     """
@@ -188,28 +305,112 @@ def get_actor_or_create(db: Session, actor_handle: str) -> Actor:
     # Get actor if exists
     actor = db.exec(select(Actor).where(Actor.name == actor_handle)).first()
 
-    if actor is None:
-        profile = get_profile(get_actor_url(actor_handle))
-        profile_picture = profile.get("icon", {}).get("url", None)
+    if actor is not None:
+        # Cheap when the caller has the url, the rest are filled by fgctl backfill-actors
+        if actor.uri is None and actor_url is not None:
+            backfill_actor_fields(db, actor, actor_url)
+        return actor
+
+    if actor_url is None:
+        actor_url = get_actor_url(actor_handle)
+    profile = get_profile(actor_url) or {}
+    profile_picture = (profile.get("icon", None) or {}).get("url", None)
+
+    if profile_picture is None:
+        profile_picture = "default"
+
+    fields = actor_fields_from_profile(actor_url, profile)
+    # Another handle can resolve to the same actor, like a user of example.com served from social.example.com
+    if fields.get("uri", None) is not None:
+        actor = get_actor_by_uri(db, fields["uri"])
+        if actor is not None:
+            return actor
+
+    actor_entry = {
+        "name": actor_handle,
+        "profile_picture": profile_picture,
+    }
+    actor_entry.update(fields)
+    actor = Actor(**actor_entry)
+    try:
+        # Only the savepoint is rolled back on a conflict, not what the caller has pending
+        with db.begin_nested():
+            db.add(actor)
+    except IntegrityError:
+        # Stored by someone else since we looked
+        actor = db.exec(select(Actor).where(or_(Actor.name == actor_handle, Actor.uri == fields.get("uri", None)))).first()
+        if actor is None:
+            raise
+        return actor
+    db.commit()
+    db.refresh(actor)
+    return actor
 
-        if profile_picture is None:
-            profile_picture = "default"
 
-        actor_entry = {
-            "name": actor_handle,
-            "profile_picture": profile_picture,
-        }
-        actor = add_actor(db=db, item=actor_entry)
+def backfill_actor_fields(db: Session, actor: Actor, actor_url: Optional[str] = None) -> Actor:
+    """Store the uri and endpoints of an actor saved before we kept them, best effort"""
+    try:
+        if actor_url is None:
+            actor_url = get_actor_url(actor.name)
+        if actor_url is None:
+            return actor
+        profile = get_profile(actor_url) or {}
+    except httpx.HTTPError as e:
+        print(f"Error: could not fetch profile of {actor.name}: {e}")
+        return actor
+
+    fields = actor_fields_from_profile(actor_url, profile)
+    if len(fields) == 0:
+        return actor
+    try:
+        with db.begin_nested():
+            for key, value in fields.items():
+                setattr(actor, key, value)
+            db.add(actor)
+    except IntegrityError:
+        # Another row already has this uri, an older duplicate of the same actor under another handle
+        print(f"Error: {actor.name} is the same actor as another row with uri {fields.get('uri', None)}, not backfilled")
+        return actor
+    db.commit()
+    db.refresh(actor)
     return actor
 
 
+def actor_fields_from_profile(actor_url: Optional[str], profile: Dict[str, Any]) -> Dict[str, Any]:
+    """The Actor columns we keep from a remote profile"""
+    if len(profile) == 0:
+        return {}
+    public_key = profile.get("publicKey", None) or {}
+    if isinstance(public_key, list):
+        public_key = public_key[0] if len(public_key) > 0 else {}
+    return {
+        "uri": profile.get("id", actor_url),
+        "inbox": inbox_from_profile(profile),
+        "shared_inbox": shared_inbox_from_profile(profile),
+        "public_key_id": public_key.get("id", None),
+        "preferred_username": profile.get("preferredUsername", None),
+    }
+
+
+def get_actors_without_uri(db: Session) -> List[Actor]:
+    return db.exec(select(Actor).where(Actor.uri == None)).all()
+
+
+def get_actor_by_uri(db: Session, actor_url: str) -> Optional[Actor]:
+    return db.exec(select(Actor).where(Actor.uri == actor_url)).first()
+
+
 def get_handle_from_url_or_create(db: Session, actor_url: str) -> Actor:
-    a = get_actor_or_create(db, actor_to_address_format(actor_url))
+    # Known actors are found by their uri without going to the network
+    actor = get_actor_by_uri(db, actor_url)
+    if actor is not None:
+        return actor
+    a = get_actor_or_create(db, actor_to_address_format(actor_url), actor_url=actor_url)
     return a
 
 
 def add_member_to_group(db: Session, item: MemberCreateRemove) -> Optional[Members]:
-    actor = get_actor_or_create(db, item["member"])
+    actor = get_actor_or_create(db, item["member"], actor_url=item.get("actor_url", None))
 
     # Get group if exists
     group = get_group_by_name(db=db, name=item["group"])
@@ -228,15 +429,57 @@ def add_member_to_group(db: Session, item: MemberCreateRemove) -> Optional[Membe
         # Use id for actor and not the name
         item["member"] = actor
         item["group"] = group
-        db_item = Members(**item)
-        db.add(db_item)
+        if item.get("inbox", None) is not None:
+            item["endpoints_updated_at"] = datetime.utcnow()
+        try:
+            # Built inside the savepoint, its relationships put it in the session right away
+            with db.begin_nested():
+                db_item = Members(**item)
+                db.add(db_item)
+        except IntegrityError:
+            # A concurrent Follow from the same actor stored the membership first
+            print(f"Member already in group: {actor.name} in {group.name}")
+            return None
+        add_group_to_home_timeline(db, actor.id, group.id)
         db.commit()
+        invalidate_followers(group.id)
         db.refresh(db_item)
         return db_item
     else:
         print(f"Error: member already in group: {member_in_group.id}")
+        if item.get("inbox", None) is not None:
+            update_member_endpoints(db, member_in_group, item.get("actor_url", None), item["inbox"], item.get("shared_inbox", None))
+            db.commit()
     return None
 
+def update_member_endpoints(db: Session, member: Members, actor_url: Optional[str], inbox: Optional[str], shared_inbox: Optional[str]) -> Members:
+    """Store where to deliver to a member, the caller commits"""
+    member.actor_url = actor_url
+    member.inbox = inbox
+    member.shared_inbox = shared_inbox
+    member.endpoints_updated_at = datetime.utcnow()
+    db.add(member)
+    return member
+
+def mark_member_endpoints_failed(db: Session, member: Members) -> Members:
+    """Remember a failed refresh so the member waits for the next stale refresh, the caller commits"""
+    member.endpoints_updated_at = datetime.utcnow()
+    db.add(member)
+    return member
+
+def get_members_needing_endpoints(db: Session, group_id: int, older_than: Optional[datetime] = None) -> List[Members]:
+    """Members of a group whose inbox was never looked up, or was last looked up before older_than"""
+    condition = and_(Members.inbox == None, Members.endpoints_updated_at == None)
+    if older_than is not None:
+        condition = or_(condition, Members.endpoints_updated_at < older_than)
+    return db.exec(select(Members).where(Members.group_id == group_id).where(condition)
+                   .options(joinedload(Members.member))).all()
+
+def get_group_delivery_inboxes(db: Session, group_id: int) -> List[str]:
+    """The distinct inboxes to deliver to for a group, shared inboxes are used when the server has one"""
+    target = func.coalesce(Members.shared_inbox, Members.inbox)
+    return db.exec(select(distinct(target)).where(Members.group_id == group_id).where(target != None)).all()
+
 def member_in_group(db: Session, group_name: str, actor: Actor) -> bool:
     # Check if exists:
     member_in_group = db.exec(select(Members).join(Group).where(
@@ -270,7 +513,9 @@ def remove_member_grom_group(db: Session, item: MemberCreateRemove) -> Optional[
     # db_item = Members(**item)
     if member_in_group is not None:
         db.delete(member_in_group)
+        remove_group_from_home_timeline(db, actor.id, group.id)
         db.commit()
+        invalidate_followers(group.id)
     return member_in_group
 
 
@@ -281,6 +526,12 @@ def get_members_list(db: Session, group: str) -> Optional[Members]:
 def get_note(db: Session, note_id: str) -> Optional[Note]:
     return db.exec(select(Note).where(Note.id == note_id)).first()
 
+async def get_note_async(db: AsyncSession, note_id: int) -> Optional[Note]:
+    """A note with its recipients and author loaded, they can not be lazy loaded on an async session"""
+    return (await db.exec(select(Note)
+                          .where(Note.id == note_id)
+                          .options(selectinload(Note.recipients), joinedload(Note.attributed)))).first()
+
 
 def get_note_by_object_id(db: Session, note_id: str) -> Optional[Note]:
     return db.exec(select(Note).where(Note.id == note_id)).first()
@@ -439,11 +690,96 @@ def get_groups_of_member(db, actor) -> List[Group]:
     groups_of_actor = db.exec(select(Members).join(Group).where(Members.member_id == actor.id))
     return [member["Group"] for member in groups_of_actor]
 
-def get_posts_for_member(db, actor_handle) -> List[Boost]:
+def select_boosts_of_member(actor: Actor, *columns):
+    """Select boosts of the groups an actor is a member of, with extra columns if given"""
+    return select(Boost, *columns).join(Group).join(Members).where(Members.member_id == actor.id)
+
+def page_of_boosts(db, statement, before: Optional[Tuple[datetime, int]], limit: int,
+                   created_at=Boost.created_at, id=Boost.id) -> List[Boost]:
+    """Newest first page of a boost listing, keyset paginated on (created_at, id)
+
+    Args:
+        db (Session): the db session
+        statement: The select of boosts to page through
+        before (Optional[Tuple[datetime, int]]): created_at and id of the last boost of the previous page, None for the first page
+        limit (int): Page size, at most PAGE_SIZE
+        created_at: Column to order on, for listings that keep a copy of the boost creation time
+        id: Column holding the boost id
+
+    Returns:
+        List[Boost]: The boosts of the page, fewer than limit on the last page
+    """
+    if before is not None:
+        statement = statement.where(tuple_(created_at, id) < tuple_(*before))
+    statement = statement.order_by(created_at.desc(), id.desc()).limit(min(limit, PAGE_SIZE))
+    return db.exec(statement).all()
+
+def get_posts_for_member(db, actor_handle, before: Optional[Tuple[datetime, int]] = None, limit: int = PAGE_SIZE) -> List[Boost]:
     actor = get_actor_or_create(db, actor_handle)
-    bossts_of_actor = db.exec(select(Boost).join(Group).join(Members).where(Members.member_id == actor.id).where(Boost.in_reply_to == None).order_by(Boost.created_at.desc()))
-    return bossts_of_actor
+    statement = select(Boost).join(HomeTimeline, HomeTimeline.boost_id == Boost.id).where(HomeTimeline.member_id == actor.id)
+    return page_of_boosts(db, statement, before, limit, HomeTimeline.created_at, HomeTimeline.boost_id)
+
+def get_threads(db: Session, root_ids: List[int]) -> Dict[Optional[int], List[Boost]]:
+    """Load whole reply trees in one query
+
+    The boosts of every tree are found with a recursive CTE and loaded with their original
+    poster, attributed actor and group joined in, so nothing is lazy loaded afterwards.
+
+    Args:
+        db (Session): the db session
+        root_ids (List[int]): Ids of the boosts at the top of the trees
+
+    Returns:
+        Dict[Optional[int], List[Boost]]: Boosts by the id of the boost they reply to, oldest first,
+            the roots are also listed under None
+    """
+    if len(root_ids) == 0:
+        return {}
+    tree = select(Boost.id).where(Boost.id.in_(root_ids)).cte("tree", recursive=True)
+    # UNION rather than UNION ALL so a reply loop can not make it run forever
+    tree = tree.union(select(Boost.id).join(tree, Boost.in_reply_to_id == tree.c.id))
+    boosts = db.exec(select(Boost)
+                     .join(tree, Boost.id == tree.c.id)
+                     .options(joinedload(Boost.original_poster), joinedload(Boost.attributed), joinedload(Boost.group))
+                     .order_by(Boost.id)
+                     .execution_options(populate_existing=True)).all()
+
+    threads: Dict[Optional[int], List[Boost]] = {}
+    roots = set(root_ids)
+    for boost in boosts:
+        threads.setdefault(boost.in_reply_to_id, []).append(boost)
+        if boost.id in roots and boost.in_reply_to_id is not None:
+            threads.setdefault(None, []).append(boost)
+    return threads
+
+def select_home_timeline_rows():
+    """Select home timeline rows of root boosts for every member of their group"""
+    return (select(Members.member_id, Boost.id, Boost.group_id, Boost.created_at)
+            .join(Members, Members.group_id == Boost.group_id)
+            .where(Boost.in_reply_to_id == None))
+
+def insert_home_timeline_rows(db: Session, rows_select) -> None:
+    statement = postgresql.insert(HomeTimeline).from_select(["member_id", "boost_id", "group_id", "created_at"], rows_select)
+    db.execute(statement.on_conflict_do_nothing())
+
+def add_to_home_timelines(db: Session, boost_ids: List[int]) -> None:
+    """Put new root boosts on the home timeline of the members of their group, the caller commits"""
+    insert_home_timeline_rows(db, select_home_timeline_rows().where(Boost.id.in_(boost_ids)))
+
+def add_group_to_home_timeline(db: Session, member_id: int, group_id: int) -> None:
+    """Put the root boosts of a group on the home timeline of a new member, the caller commits"""
+    insert_home_timeline_rows(db, select_home_timeline_rows()
+                              .where(Members.member_id == member_id).where(Boost.group_id == group_id))
+
+def remove_group_from_home_timeline(db: Session, member_id: int, group_id: int) -> None:
+    """Drop the boosts of a group from the home timeline of a member who left it, the caller commits"""
+    db.execute(delete(HomeTimeline).where(HomeTimeline.member_id == member_id).where(HomeTimeline.group_id == group_id))
+
+def rebuild_home_timeline_of_group(db: Session, group_id: int) -> None:
+    """Rewrite the home timeline rows of a group from its boosts and members"""
+    db.execute(delete(HomeTimeline).where(HomeTimeline.group_id == group_id))
+    insert_home_timeline_rows(db, select_home_timeline_rows().where(Boost.group_id == group_id))
+    db.commit()
 
-def get_posts_public(db, actor_handle) -> List[Boost]:
-    boosts = db.exec(select(Boost).where(Boost.in_reply_to == None).order_by(Boost.created_at.desc()))
-    return boosts
+def get_posts_public(db, actor_handle, before: Optional[Tuple[datetime, int]] = None, limit: int = PAGE_SIZE) -> List[Boost]:
+    return page_of_boosts(db, select(Boost).where(Boost.in_reply_to_id == None), before, limit)
@@ -10,17 +10,33 @@ from sqlalchemy.orm import sessionmaker, backref
 from sqlmodel import Session
 from sqlalchemy import Column, Integer, Enum
 from typing import Dict, List, Optional
-from sqlalchemy.dialects.postgresql import JSON
-import databases
+from sqlalchemy.dialects.postgresql import JSON, JSONB, TSVECTOR
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
 import secrets
 import string
 SECRET_SIZE = 10
 
 config = get_config()
 DATABASE_URL = config["main"]["database_url"]
+DATABASE_CONFIG = config.get("database", None) or {}
 
-DATABASE_URL = config["main"]["database_url"]
-database = databases.Database(DATABASE_URL)
+POOL_SIZE = DATABASE_CONFIG.get("pool_size", 10)
+MAX_OVERFLOW = DATABASE_CONFIG.get("max_overflow", 20)
+ASYNC_POOL_SIZE = DATABASE_CONFIG.get("async_pool_size", 10)
+ASYNC_MAX_OVERFLOW = DATABASE_CONFIG.get("async_max_overflow", 20)
+# Seconds to wait for a free connection, and after which a connection is replaced
+POOL_TIMEOUT = DATABASE_CONFIG.get("pool_timeout", 30)
+POOL_RECYCLE = DATABASE_CONFIG.get("pool_recycle", 1800)
+
+
+def get_async_database_url(database_url: str) -> str:
+    """The asyncpg flavour of the database url, unless one is set in database_url_async"""
+    async_url = config["main"].get("database_url_async", None)
+    if async_url is not None:
+        return async_url
+    scheme, rest = database_url.split("://", 1)
+    return scheme.split("+")[0] + "+asyncpg://" + rest
 
 class Setting(SQLModel, table=True):
     __tablename__ = "settings"
@@ -60,7 +76,15 @@ class Group(SQLModel, table=True):
 # https://www.w3.org/TR/activitypub/#followers
 class Members(SQLModel, table=True):
     __tablename__ = "groups_members"
-    __table_args__ = {'extend_existing': True}
+    __table_args__ = (
+        sqlalchemy.Index("ix_groups_members_group_id_shared_inbox", "group_id", "shared_inbox"),
+        # An actor is a member of a group once, this also serves every membership check
+        sqlalchemy.Index("ix_groups_members_group_id_member_id", "group_id", "member_id", unique=True),
+        sqlalchemy.Index("ix_groups_members_member_id", "member_id"),
+        # Pages of the followers collection
+        sqlalchemy.Index("ix_groups_members_group_id_id", "group_id", "id"),
+        {'extend_existing': True},
+    )
     id: Optional[int] = Field(default=None, primary_key=True)
     group_id: int = Field(default=None, foreign_key="groups.id")
     group: Optional[Group] = Relationship(back_populates="members")
@@ -70,6 +94,12 @@ class Members(SQLModel, table=True):
 
     created_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
 
+    # Where to deliver to the member, stored at follow time so fan-out needs no network
+    actor_url: Optional[str] = Field(default=None, nullable=True, index=True)
+    inbox: Optional[str] = Field(default=None, nullable=True)
+    shared_inbox: Optional[str] = Field(default=None, nullable=True)
+    endpoints_updated_at: Optional[datetime] = Field(default=None, nullable=True)
+
 # These are the notes status, each status is like a thread topic
 class Announces(SQLModel, table=True):
     __tablename__ = "groups_topics"
@@ -86,7 +116,7 @@ class NoteRecipients(SQLModel, table=True):
     __tablename__ = "notes_recipients"
     __table_args__ = {'extend_existing': True}
     id: Optional[int] = Field(default=None, primary_key=True)
-    note_id: int = Field(default=None, foreign_key="notes.id")
+    note_id: int = Field(default=None, foreign_key="notes.id", index=True)
     url: str = Field()
     type: RecipientType = Field(sa_column=Column(Enum(RecipientType)))
 
@@ -101,7 +131,7 @@ class BoostRecipients(SQLModel, table=True):
     __tablename__ = "boosts_recipients"
     __table_args__ = {'extend_existing': True}
     id: Optional[int] = Field(default=None, primary_key=True)
-    boost_id: int = Field(default=None, foreign_key="boosts.id")
+    boost_id: int = Field(default=None, foreign_key="boosts.id", index=True)
     url: str = Field()
     type: RecipientType = Field(sa_column=Column(Enum(RecipientType)))
 
@@ -113,10 +143,16 @@ class BoostRecipients(SQLModel, table=True):
 
 class Actor(SQLModel, table=True):
     __tablename__ = "actors"
-    __table_args__ = (UniqueConstraint("name"),)
+    __table_args__ = (UniqueConstraint("name"), sqlalchemy.Index("ix_actors_uri", "uri", unique=True))
     id: Optional[int] = Field(default=None, primary_key=True)
     name: str = Field(index=True)
     profile_picture: str = Field()
+    # Canonical id of the actor, lets us turn an actor url to its handle without the network
+    uri: Optional[str] = Field(default=None, nullable=True)
+    inbox: Optional[str] = Field(default=None, nullable=True)
+    shared_inbox: Optional[str] = Field(default=None, nullable=True)
+    public_key_id: Optional[str] = Field(default=None, nullable=True)
+    preferred_username: Optional[str] = Field(default=None, nullable=True)
 
     # based of this comment: https://github.com/tiangolo/sqlmodel/issues/10#issuecomment-1020647477
     notes: List["Note"] = Relationship(back_populates="attributed",
@@ -133,6 +169,48 @@ class Actor(SQLModel, table=True):
 
 
 
+# Cache of actor documents fetched from other servers
+class RemoteActor(SQLModel, table=True):
+    __tablename__ = "remote_actors"
+    __table_args__ = {'extend_existing': True}
+    url: str = Field(primary_key=True)
+    data: Dict = Field(default={}, sa_column=Column(JSON))
+    fetched_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
+    etag: Optional[str] = Field(default=None, nullable=True)
+    last_modified: Optional[str] = Field(default=None, nullable=True)
+
+
+# Cache of webfinger lookups, actor_url is None for handles that failed to resolve
+class WebfingerCache(SQLModel, table=True):
+    __tablename__ = "webfinger_cache"
+    __table_args__ = {'extend_existing': True}
+    handle: str = Field(primary_key=True)
+    actor_url: Optional[str] = Field(default=None, nullable=True)
+    fetched_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
+    expires_at: datetime = Field(nullable=False, index=True)
+
+
+# ActivityPub objects we fetched, shared by everything that references them
+class RemoteObject(SQLModel, table=True):
+    __tablename__ = "remote_objects"
+    __table_args__ = {'extend_existing': True}
+    id: str = Field(primary_key=True)
+    data: Dict = Field(default={}, sa_column=Column(JSONB))
+    content_hash: str = Field()
+    fetched_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
+    etag: Optional[str] = Field(default=None, nullable=True)
+    last_modified: Optional[str] = Field(default=None, nullable=True)
+
+
+# Ids of activities we already took in, so retried and relayed deliveries are only handled once
+class SeenActivity(SQLModel, table=True):
+    __tablename__ = "seen_activities"
+    __table_args__ = {'extend_existing': True}
+    activity_id: str = Field(primary_key=True)
+    seen_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
+    expires_at: datetime = Field(nullable=False, index=True)
+
+
 # Notes are in-server status messages
 class Note(SQLModel, table=True):
     __tablename__ = "notes"
@@ -163,12 +241,28 @@ class Note(SQLModel, table=True):
     recipients: List[NoteRecipients] = Relationship(back_populates="note")
 
 
+# Text search configuration of boosts.search_vector, changing it needs a migration
+SEARCH_TEXT_CONFIG = "simple"
+
+
 # Boosts are announce status messages from other server, we also save the content so we can search for it
 class Boost(SQLModel, table=True):
     __tablename__ = "boosts"
-    __table_args__ = {'extend_existing': True}
+    __table_args__ = (
+        sqlalchemy.Index("ix_boosts_note_id", "note_id"),
+        # Group timelines, newest first
+        sqlalchemy.Index("ix_boosts_group_id_created_at", "group_id", "created_at"),
+        # Keyset pages of the member and public timelines, which only list root posts
+        sqlalchemy.Index("ix_boosts_roots_group_id_created_at_id", "group_id", "created_at", "id",
+                         postgresql_where=sqlalchemy.text("in_reply_to_id IS NULL")),
+        sqlalchemy.Index("ix_boosts_roots_created_at_id", "created_at", "id",
+                         postgresql_where=sqlalchemy.text("in_reply_to_id IS NULL")),
+        # Comment trees
+        sqlalchemy.Index("ix_boosts_in_reply_to_id", "in_reply_to_id"),
+        sqlalchemy.Index("ix_boosts_search_vector", "search_vector", postgresql_using="gin"),
+        {'extend_existing': True},
+    )
     id: Optional[int] = Field(default=None, primary_key=True)
-    attachment: list = Field(default=[], sa_column=Column(JSON))
 
     group_id: Optional[int] = Field(default=None, foreign_key="groups.id")
     group: Optional[Group] = Relationship(sa_relationship_kwargs={"primaryjoin": "Boost.group_id==Group.id"})
@@ -184,6 +278,9 @@ class Boost(SQLModel, table=True):
 
     content: str = Field()
     note_id: str = Field() # What we are boosting
+    # The boosted note as fetched, source and attachment are read from it rather than copied
+    remote_object_id: Optional[str] = Field(default=None, foreign_key="remote_objects.id", index=True)
+    remote_object: Optional[RemoteObject] = Relationship(sa_relationship_kwargs={"primaryjoin": "Boost.remote_object_id==RemoteObject.id"})
     
     in_reply_to_id: Optional[int] = Field(default=None, foreign_key="boosts.id")
     comments: List["Boost"] = Relationship(
@@ -193,7 +290,6 @@ class Boost(SQLModel, table=True):
         )
     )
     
-    source: Dict = Field(default=[], sa_column=Column(JSON))
     original_time: datetime = Field(nullable=False)
     summary: Optional[str] = None
     # # I think this is used in OStatus stuff: https://socialhub.activitypub.rocks/t/context-vs-conversation/578/7
@@ -203,8 +299,97 @@ class Boost(SQLModel, table=True):
     # # class Config:
     # #     arbitrary_types_allowed = True
 
+    # Summary and content with the html stripped, kept up to date by postgres
+    search_vector: Optional[str] = Field(default=None, sa_column=Column(TSVECTOR, sqlalchemy.Computed(
+        f"setweight(to_tsvector('{SEARCH_TEXT_CONFIG}', regexp_replace(coalesce(summary, ''), '<[^>]*>', ' ', 'g')), 'A') || "
+        f"setweight(to_tsvector('{SEARCH_TEXT_CONFIG}', regexp_replace(coalesce(content, ''), '<[^>]*>', ' ', 'g')), 'B')",
+        persisted=True)))
+
     recipients: List[BoostRecipients] = Relationship(back_populates="boost_relation")
 
+    @property
+    def source(self) -> Dict:
+        return self.remote_object.data.get("source", {}) if self.remote_object is not None else {}
+
+    @property
+    def attachment(self) -> list:
+        return self.remote_object.data.get("attachment", []) if self.remote_object is not None else []
+
+
+# The home timeline of each member, one row per root boost of their groups, written when
+# the boost is stored or the member follows, so reading it is a range scan
+class HomeTimeline(SQLModel, table=True):
+    __tablename__ = "home_timeline"
+    __table_args__ = (
+        sqlalchemy.Index("ix_home_timeline_member_id_created_at_boost_id", "member_id", "created_at", "boost_id"),
+        # Trimming on unfollow
+        sqlalchemy.Index("ix_home_timeline_group_id_member_id", "group_id", "member_id"),
+        {'extend_existing': True},
+    )
+    member_id: int = Field(foreign_key="actors.id", primary_key=True)
+    boost_id: int = Field(sa_column=Column(Integer, sqlalchemy.ForeignKey("boosts.id", ondelete="CASCADE"), primary_key=True))
+    group_id: int = Field(foreign_key="groups.id")
+    # Copied from the boost so the timeline is ordered without reading boosts
+    created_at: datetime = Field(nullable=False)
+
+
+# Activities waiting to be delivered to other servers, the body is stored already serialized
+class OutboxActivity(SQLModel, table=True):
+    __tablename__ = "outbox_activities"
+    __table_args__ = (UniqueConstraint("activity_id"),)
+    id: Optional[int] = Field(default=None, primary_key=True)
+    activity_id: str = Field()
+    body: str = Field()
+    key_id: str = Field()
+    key_path: str = Field()
+    created_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
+
+    deliveries: List["Delivery"] = Relationship(back_populates="activity")
+
+
+# One row per activity per inbox, drained by the delivery workers
+class Delivery(SQLModel, table=True):
+    __tablename__ = "deliveries"
+    __table_args__ = (
+        sqlalchemy.Index("ix_deliveries_pending", "next_attempt_at",
+                         postgresql_where=sqlalchemy.text("delivered_at IS NULL AND failed_at IS NULL")),
+        {'extend_existing': True},
+    )
+    id: Optional[int] = Field(default=None, primary_key=True)
+    activity_id: int = Field(foreign_key="outbox_activities.id", index=True)
+    activity: Optional[OutboxActivity] = Relationship(back_populates="deliveries")
+    inbox: str = Field()
+    attempts: int = Field(default=0, nullable=False)
+    next_attempt_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
+    last_error: Optional[str] = Field(default=None, nullable=True)
+    created_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
+    delivered_at: Optional[datetime] = Field(default=None, nullable=True)
+    # Set when we gave up on the delivery
+    failed_at: Optional[datetime] = Field(default=None, nullable=True)
+
+
+# Raw activities posted to our inboxes, waiting to be verified and handled by the inbox processors
+class InboxJournal(SQLModel, table=True):
+    __tablename__ = "inbox_journal"
+    __table_args__ = (
+        sqlalchemy.Index("ix_inbox_journal_pending", "next_attempt_at",
+                         postgresql_where=sqlalchemy.text("processed_at IS NULL AND failed_at IS NULL")),
+        {'extend_existing': True},
+    )
+    id: Optional[int] = Field(default=None, primary_key=True)
+    received_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
+    # The group whose inbox got the activity, None for the shared inbox
+    group_name: Optional[str] = Field(default=None, nullable=True)
+    path: str = Field()
+    headers: Dict = Field(default={}, sa_column=Column(JSON))
+    body: str = Field()
+    attempts: int = Field(default=0, nullable=False)
+    next_attempt_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
+    last_error: Optional[str] = Field(default=None, nullable=True)
+    processed_at: Optional[datetime] = Field(default=None, nullable=True)
+    # Set when we gave up on the activity
+    failed_at: Optional[datetime] = Field(default=None, nullable=True)
+
 
 class Tag(SQLModel, table=True):
     __tablename__ = "tags"
@@ -266,12 +451,28 @@ class OauthCode(SQLModel, table=True):
 # Init
 engine = sqlalchemy.create_engine(
     DATABASE_URL, 
+    pool_size=POOL_SIZE,
+    max_overflow=MAX_OVERFLOW,
+    pool_timeout=POOL_TIMEOUT,
+    pool_recycle=POOL_RECYCLE,
     # echo=True
 )
 # SQLModel.metadata.create_all(engine)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, class_=Session)
 
+# Used by the read heavy routes so their queries do not block the event loop
+async_engine = create_async_engine(
+    get_async_database_url(DATABASE_URL),
+    pool_size=ASYNC_POOL_SIZE,
+    max_overflow=ASYNC_MAX_OVERFLOW,
+    pool_timeout=POOL_TIMEOUT,
+    pool_recycle=POOL_RECYCLE,
+)
+
+# Objects stay usable after commit, lazy loading is not possible on an async session
+AsyncSessionLocal = sessionmaker(bind=async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
 # init config values
 def init_db(SessionLocal):
     db = SessionLocal()
@@ -295,4 +496,8 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
\ No newline at end of file
@@ -0,0 +1,234 @@
+"""Durable queue of outgoing deliveries
+
+Every activity we send is stored once in outbox_activities with one deliveries row per
+inbox. A pool of async workers claims due deliveries with SELECT ... FOR UPDATE SKIP
+LOCKED, so several worker processes can drain the same queue, and failed deliveries are
+retried with exponential backoff and jitter. Nothing is lost when the process restarts.
+
+Claimed deliveries are sent in batches through the fan-out engine, so one activity
+goes to many inboxes in parallel under the global and per-host limits.
+"""
+import asyncio
+import json
+import random
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import update, func
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import select, Session
+
+from app.common import get_config
+from app.db import Delivery, OutboxActivity, SessionLocal
+from app.fanout import FanoutLimiter, DeliveryResult, deliver_many
+
+config = get_config()
+DELIVERY_CONFIG = config.get("delivery", None) or {}
+
+WORKERS = DELIVERY_CONFIG.get("workers", 4)
+RUN_IN_APP = DELIVERY_CONFIG.get("run_in_app", True)
+POLL_INTERVAL = DELIVERY_CONFIG.get("poll_interval", 1)
+# Deliveries a worker claims at once
+BATCH_SIZE = DELIVERY_CONFIG.get("batch_size", 100)
+# How long a claimed delivery is hidden from other workers before it is considered lost
+LEASE_TIMEOUT = DELIVERY_CONFIG.get("lease_timeout", 300)
+MAX_ATTEMPTS = DELIVERY_CONFIG.get("max_attempts", 10)
+BACKOFF_BASE = DELIVERY_CONFIG.get("backoff_base", 30)
+BACKOFF_MAX = DELIVERY_CONFIG.get("backoff_max", 86400)
+
+# Client errors that are worth retrying, the rest of 4xx will not get better
+RETRYABLE_CLIENT_ERRORS = (408, 429)
+
+
+class ClaimedDelivery:
+    """A delivery a worker owns until it records the result"""
+
+    def __init__(self, id: int, activity_id: int, inbox: str, attempts: int, body: str, key_id: str, key_path: str) -> None:
+        self.id = id
+        self.activity_id = activity_id
+        self.inbox = inbox
+        self.attempts = attempts
+        self.body = body
+        self.key_id = key_id
+        self.key_path = key_path
+
+
+def enqueue_delivery(db: Session, activity: Dict[str, Any], inboxes: List[str], key_id: str, key_path: str) -> Optional[OutboxActivity]:
+    """Store an activity and queue it for delivery to every inbox
+
+    Args:
+        db (Session): the db session
+        activity (Dict[str, Any]): The activity to send, it is serialized once here
+        inboxes (List[str]): Inboxes to deliver to
+        key_id (str): The keyId to sign with
+        key_path (str): Path of the private key to sign with
+
+    Returns:
+        Optional[OutboxActivity]: The stored activity, None if there was nothing to deliver
+    """
+    inboxes = [inbox for inbox in dict.fromkeys(inboxes) if inbox is not None]
+    if len(inboxes) == 0:
+        return None
+
+    outbox_activity = OutboxActivity(
+        activity_id=activity["id"],
+        body=json.dumps(activity),
+        key_id=key_id,
+        key_path=key_path,
+    )
+    db.add(outbox_activity)
+    db.flush()
+
+    now = datetime.utcnow()
+    db.execute(insert(Delivery).values([
+        {"activity_id": outbox_activity.id, "inbox": inbox, "attempts": 0,
+         "next_attempt_at": now, "created_at": now}
+        for inbox in inboxes
+    ]))
+    db.commit()
+    return outbox_activity
+
+
+def claim_deliveries(limit: int = 1) -> List[ClaimedDelivery]:
+    """Claim due deliveries, rows locked by another worker are skipped"""
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        rows = db.exec(select(Delivery, OutboxActivity)
+                       .join(OutboxActivity, Delivery.activity_id == OutboxActivity.id)
+                       .where(Delivery.delivered_at == None)
+                       .where(Delivery.failed_at == None)
+                       .where(Delivery.next_attempt_at <= now)
+                       .order_by(Delivery.next_attempt_at)
+                       .limit(limit)
+                       .with_for_update(skip_locked=True, of=Delivery)).all()
+
+        claimed = []
+        for delivery, outbox_activity in rows:
+            # Hide it from the other workers while we send it
+            delivery.next_attempt_at = now + timedelta(seconds=LEASE_TIMEOUT)
+            claimed.append(ClaimedDelivery(delivery.id, delivery.activity_id, delivery.inbox, delivery.attempts,
+                                           outbox_activity.body, outbox_activity.key_id,
+                                           outbox_activity.key_path))
+        db.commit()
+        return claimed
+    finally:
+        db.close()
+
+
+def backoff_delay(attempts: int) -> float:
+    """Exponential backoff with jitter, in seconds"""
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** (attempts - 1)))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def should_retry(result: DeliveryResult) -> bool:
+    if result.status_code is None:
+        return True
+    return result.status_code >= 500 or result.status_code in RETRYABLE_CLIENT_ERRORS
+
+
+def record_delivery_results(results: List[Tuple[ClaimedDelivery, DeliveryResult]]) -> None:
+    """Mark claimed deliveries as done, or schedule their retry, in one transaction"""
+    now = datetime.utcnow()
+    db = SessionLocal()
+    try:
+        for delivery, result in results:
+            if result.success:
+                values = {"delivered_at": now, "last_error": None}
+            else:
+                attempts = delivery.attempts + 1
+                values = {"attempts": attempts, "last_error": result.error[:1000]}
+                if should_retry(result) and attempts < MAX_ATTEMPTS:
+                    values["next_attempt_at"] = now + timedelta(seconds=backoff_delay(attempts))
+                else:
+                    print(f"Giving up delivery to {delivery.inbox}: {result.error}")
+                    values["failed_at"] = now
+            db.execute(update(Delivery).where(Delivery.id == delivery.id).values(**values))
+        db.commit()
+    finally:
+        db.close()
+
+
+def get_pending_deliveries_count(db: Session) -> int:
+    return db.exec(select(func.count(Delivery.id))
+                   .where(Delivery.delivered_at == None)
+                   .where(Delivery.failed_at == None)).one()
+
+
+async def deliver(deliveries: List[ClaimedDelivery], limiter: FanoutLimiter) -> None:
+    """Send claimed deliveries, one fan-out per activity, and record the results"""
+    by_activity: Dict[int, List[ClaimedDelivery]] = {}
+    for delivery in deliveries:
+        by_activity.setdefault(delivery.activity_id, []).append(delivery)
+
+    async def deliver_activity(group: List[ClaimedDelivery]) -> List[Tuple[ClaimedDelivery, DeliveryResult]]:
+        first = group[0]
+        results = await deliver_many(first.body, [delivery.inbox for delivery in group],
+                                     first.key_id, first.key_path, limiter)
+        return list(zip(group, results))
+
+    groups = list(by_activity.values())
+    batches = await asyncio.gather(*[deliver_activity(group) for group in groups], return_exceptions=True)
+
+    results = []
+    for group, batch in zip(groups, batches):
+        if isinstance(batch, BaseException):
+            # Such as a missing signing key, count it as a failed attempt so the deliveries
+            # back off and eventually give up instead of being reclaimed forever
+            print(f"Error delivering activity {group[0].activity_id}: {batch}")
+            error = f"{type(batch).__name__}: {batch}"
+            batch = [(delivery, DeliveryResult(delivery.inbox, None, error, 0)) for delivery in group]
+        results += batch
+    await asyncio.to_thread(record_delivery_results, results)
+
+
+class DeliveryWorkerPool:
+    """A pool of async workers draining the delivery queue
+
+    Args:
+        workers (int): Number of workers claiming batches, all of them share one fan-out limiter
+    """
+
+    def __init__(self, workers: int = WORKERS) -> None:
+        self.workers = workers
+        self._limiter: Optional[FanoutLimiter] = None
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = False
+
+    async def _worker(self) -> None:
+        while not self._stopping:
+            try:
+                claimed = await asyncio.to_thread(claim_deliveries, BATCH_SIZE)
+                if len(claimed) == 0:
+                    await asyncio.sleep(POLL_INTERVAL)
+                    continue
+                print(f"Sending {len(claimed)} deliveries")
+                await deliver(claimed, self._limiter)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Keep the worker alive, the lease makes sure the delivery is retried
+                print(f"Error in delivery worker: {e}")
+                await asyncio.sleep(POLL_INTERVAL)
+
+    def start(self) -> None:
+        self._stopping = False
+        # Created here so its semaphores belong to the running loop
+        self._limiter = FanoutLimiter()
+        for _ in range(self.workers):
+            self._tasks.append(asyncio.ensure_future(self._worker()))
+
+    async def stop(self) -> None:
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def run_forever(self) -> None:
+        self.start()
+        try:
+            await asyncio.gather(*self._tasks)
+        finally:
+            await self.stop()
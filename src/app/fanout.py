@@ -0,0 +1,105 @@
+"""Concurrent delivery of one activity to many inboxes
+
+Sends run in parallel under a global cap and a per-host cap, so a big fan-out is not
+a long chain of round trips and no single instance gets hammered. The body and its
+digest are prepared once per batch, only the headers are signed per inbox.
+"""
+import asyncio
+import time
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+from app.common import get_config
+from app.http_sig import get_signer, PreparedBody, Signer
+from app.send_federated_data import send_prepared_async
+
+config = get_config()
+DELIVERY_CONFIG = config.get("delivery", None) or {}
+
+MAX_CONCURRENCY = DELIVERY_CONFIG.get("max_concurrency", 50)
+PER_HOST_CONCURRENCY = DELIVERY_CONFIG.get("per_host_concurrency", 4)
+
+
+class DeliveryResult:
+    """The outcome of sending to one inbox"""
+
+    def __init__(self, inbox: str, status_code: Optional[int], error: Optional[str], elapsed: float) -> None:
+        self.inbox = inbox
+        self.status_code = status_code
+        self.error = error
+        # Seconds spent on the request, not counting time waiting for a free slot
+        self.elapsed = elapsed
+
+    @property
+    def success(self) -> bool:
+        return self.error is None
+
+    def __repr__(self) -> str:
+        return f"DeliveryResult({self.inbox!r}, status_code={self.status_code}, error={self.error!r}, elapsed={self.elapsed:.3f})"
+
+
+class FanoutLimiter:
+    """Global and per-host concurrency limits, share one between batches to cap them together
+
+    Args:
+        max_concurrency (int): Requests in flight at once overall
+        per_host_concurrency (int): Requests in flight at once to the same host
+    """
+
+    def __init__(self, max_concurrency: int = MAX_CONCURRENCY, per_host_concurrency: int = PER_HOST_CONCURRENCY) -> None:
+        self.per_host_concurrency = per_host_concurrency
+        self._global = asyncio.Semaphore(max_concurrency)
+        self._hosts: Dict[str, asyncio.Semaphore] = {}
+
+    def host(self, inbox: str) -> asyncio.Semaphore:
+        host = urlparse(inbox).netloc
+        semaphore = self._hosts.get(host, None)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.per_host_concurrency)
+            self._hosts[host] = semaphore
+        return semaphore
+
+    @property
+    def global_limit(self) -> asyncio.Semaphore:
+        return self._global
+
+
+async def _deliver_one(inbox: str, prepared: PreparedBody, signer: Signer, limiter: FanoutLimiter) -> DeliveryResult:
+    async with limiter.host(inbox):
+        async with limiter.global_limit:
+            start = time.monotonic()
+            try:
+                r = await send_prepared_async(inbox, prepared, signer)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Transport errors, but also malformed inbox urls (httpx.InvalidURL) and signing errors,
+                # one bad inbox must not keep the rest of the batch from being recorded
+                return DeliveryResult(inbox, None, f"{type(e).__name__}: {e}", time.monotonic() - start)
+            elapsed = time.monotonic() - start
+
+    error = None
+    if r.status_code >= 400:
+        error = f"HTTP {r.status_code}"
+    return DeliveryResult(inbox, r.status_code, error, elapsed)
+
+
+async def deliver_many(body: str, inboxes: List[str], key_id: str, key_path: str,
+                       limiter: Optional[FanoutLimiter] = None) -> List[DeliveryResult]:
+    """Send one serialized activity to many inboxes in parallel
+
+    Args:
+        body (str): The serialized activity
+        inboxes (List[str]): Inboxes to deliver to
+        key_id (str): The keyId to sign with
+        key_path (str): Path of the private key to sign with
+        limiter (Optional[FanoutLimiter]): Limits to share with other fan-outs, a new one is used if not given
+
+    Returns:
+        List[DeliveryResult]: One result per inbox, in the same order as inboxes
+    """
+    if limiter is None:
+        limiter = FanoutLimiter()
+    signer = get_signer(key_id, key_path)
+    prepared = signer.prepare(body)
+    return await asyncio.gather(*[_deliver_one(inbox, prepared, signer, limiter) for inbox in inboxes])
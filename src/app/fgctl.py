@@ -1,8 +1,14 @@
 #!/usr/bin/env python3
+import asyncio
 import typer
 
-from app.send_group import fedigroup_message, fedigroup_boost
-from app.crud import get_posts_for_member
+from app.send_group import fedigroup_message, fedigroup_boost, refresh_member_endpoints, refresh_stale_member_endpoints
+from app.crud import get_posts_for_member, get_groups, get_actors_without_uri, backfill_actor_fields, PAGE_SIZE, \
+rebuild_home_timeline_of_group
+from app.delivery_queue import DeliveryWorkerPool, WORKERS
+from app.inbox import InboxProcessorPool, PROCESSORS
+from app.seen_activities import purge_expired_activities
+from app.query_plans import check_query_plans as run_query_plan_checks
 
 from app.common import SERVER_URL, multi_urljoin
 
@@ -38,13 +44,92 @@ def boost_message(group: str, note_id: str):
 @app.command()
 def post_of_member(actor_handle: str):
     db = SessionLocal()
-    for post in get_posts_for_member(db, actor_handle):
-        print(f'{post.content} at {post.created_at}')
+    before = None
+    while True:
+        posts = get_posts_for_member(db, actor_handle, before)
+        for post in posts:
+            print(f'{post.content} at {post.created_at}')
+        if len(posts) < PAGE_SIZE:
+            break
+        before = (posts[-1].created_at, posts[-1].id)
     db.close()
 
 
+@app.command()
+def refresh_member_inboxes():
+    """Resolve and store the inboxes of all group members"""
+    db = SessionLocal()
+    for group in get_groups(db):
+        print(f"Refreshing members of {group.name}")
+        refresh_member_endpoints(db, group.members)
+    db.close()
+
+
+@app.command()
+def refresh_stale_member_inboxes():
+    """Refresh member inboxes older than member_endpoints_ttl, meant to run from cron"""
+    db = SessionLocal()
+    for group in get_groups(db):
+        refreshed = refresh_stale_member_endpoints(db, group.id)
+        print(f"Refreshed {refreshed} members of {group.name}")
+    db.close()
 
 
+@app.command()
+def rebuild_home_timelines():
+    """Rewrite the home timelines of all members from the stored boosts, one group at a time"""
+    db = SessionLocal()
+    for group in get_groups(db):
+        print(f"Rebuilding home timelines for {group.name}")
+        rebuild_home_timeline_of_group(db, group.id)
+    db.close()
+
+
+@app.command()
+def backfill_actors():
+    """Store the uri and endpoints of actors saved before they were kept"""
+    db = SessionLocal()
+    for actor in get_actors_without_uri(db):
+        backfill_actor_fields(db, actor)
+        print(f"{actor.name}: {actor.uri}")
+    db.close()
+
+
+@app.command()
+def delivery_worker(workers: int = WORKERS):
+    """Run delivery workers outside the web server, several can run at once"""
+    print(f"Starting {workers} delivery workers")
+    asyncio.run(DeliveryWorkerPool(workers).run_forever())
+
+
+@app.command()
+def inbox_processor(processors: int = PROCESSORS):
+    """Run inbox processors outside the web server, for the journal inbox mode"""
+    print(f"Starting {processors} inbox processors")
+    pool = InboxProcessorPool(processors)
+    pool.start()
+    pool.join()
+
+
+@app.command()
+def purge_seen_activities():
+    """Delete expired activity ids from the dedupe table"""
+    db = SessionLocal()
+    removed = purge_expired_activities(db)
+    db.close()
+    print(f"Removed {removed} expired activity ids")
+
+
+@app.command()
+def check_query_plans(actors: int = 20000, groups: int = 200, boosts: int = 100000, notes: int = 10000):
+    """Fail if a hot crud query scans a big table sequentially, on seeded data that is rolled back"""
+    failures = run_query_plan_checks(actors, groups, boosts, notes)
+    for failure in failures:
+        print(failure)
+    if len(failures) > 0:
+        raise typer.Exit(code=1)
+    print("All hot queries use indexes")
+
 
 if __name__ == "__main__":
     app()
@@ -0,0 +1,120 @@
+"""Paged followers collection of the groups
+
+The collection links to pages of members in the order they joined, each page is one
+keyset query joining the members to their actors. Remote servers crawl the collection
+over and over, so the member count and the rendered pages are cached for a short time
+and dropped when the membership of the group changes.
+"""
+import json
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.cache import TTLCache
+from app.common import get_config, get_context, get_group_path
+from app.db import Actor, Group, Members
+
+config = get_config()
+FOLLOWERS_CONFIG = config.get("followers", None) or {}
+
+PAGE_SIZE = FOLLOWERS_CONFIG.get("page_size", 100)
+CACHE_TTL = FOLLOWERS_CONFIG.get("cache_ttl", 60)
+CACHE_MEMORY_SIZE = FOLLOWERS_CONFIG.get("cache_memory_size", 1000)
+
+_counts = TTLCache(CACHE_MEMORY_SIZE, CACHE_TTL)
+_pages = TTLCache(CACHE_MEMORY_SIZE, CACHE_TTL)
+# Bumped when the members of a group change, cached entries carry the generation they were made in
+_generations: Dict[int, int] = {}
+
+
+def invalidate_followers(group_id: int) -> None:
+    """Drop the cached count and pages of a group, call when a member joins or leaves"""
+    _generations[group_id] = _generations.get(group_id, 0) + 1
+
+
+async def count_followers(db: AsyncSession, group_id: int) -> int:
+    key = (group_id, _generations.get(group_id, 0))
+    count = _counts.get(key)
+    if count is None:
+        count = (await db.exec(select(func.count(Members.id)).where(Members.group_id == group_id))).one()
+        _counts.set(key, count)
+    return count
+
+
+async def get_followers_page(db: AsyncSession, group_id: int, after: Optional[int] = None) -> Tuple[List[str], Optional[int]]:
+    """One page of the followers of a group
+
+    Args:
+        db (AsyncSession): the db session
+        group_id (int): The group
+        after (Optional[int]): The membership id the previous page ended with, None for the first page
+
+    Returns:
+        Tuple[List[str], Optional[int]]: The actor urls on the page and the membership id to continue after,
+            None on the last page
+    """
+    # Members from before the actor urls were stored fall back to the actor row
+    actor_url = func.coalesce(Members.actor_url, Actor.uri, Actor.name)
+    statement = (select(Members.id, actor_url)
+                 .join(Actor, Actor.id == Members.member_id)
+                 .where(Members.group_id == group_id))
+    if after is not None:
+        statement = statement.where(Members.id > after)
+    # One more than a page tells whether there is a next page
+    rows = (await db.exec(statement.order_by(Members.id).limit(PAGE_SIZE + 1))).all()
+
+    next_after = None
+    if len(rows) > PAGE_SIZE:
+        rows = rows[:PAGE_SIZE]
+        next_after = rows[-1][0]
+    return [url for _, url in rows], next_after
+
+
+async def render_followers(db: AsyncSession, group: Group, page: bool = False, after: Optional[int] = None) -> str:
+    """The serialized followers collection of a group, or one of its pages
+
+    Args:
+        db (AsyncSession): the db session
+        group (Group): The group
+        page (bool): Render a page of members rather than the collection
+        after (Optional[int]): The membership id to start the page after
+
+    Returns:
+        str: The json document
+    """
+    key = (group.id, _generations.get(group.id, 0), page, after)
+    body = _pages.get(key)
+    if body is not None:
+        return body
+
+    followers_url = get_group_path(group.name) + "/followers"
+    total_items = await count_followers(db, group.id)
+    if not page:
+        document = {
+            "@context": get_context(),
+            "id": followers_url,
+            "type": "OrderedCollection",
+            "totalItems": total_items,
+            "first": followers_url + "?page=true",
+        }
+    else:
+        items, next_after = await get_followers_page(db, group.id, after)
+        page_id = followers_url + "?page=true"
+        if after is not None:
+            page_id += f"&after={after}"
+        document = {
+            "@context": get_context(),
+            "id": page_id,
+            "type": "OrderedCollectionPage",
+            "partOf": followers_url,
+            "totalItems": total_items,
+            "orderedItems": items,
+        }
+        if next_after is not None:
+            document["next"] = followers_url + f"?page=true&after={next_after}"
+
+    body = json.dumps(document)
+    _pages.set(key, body)
+    return body
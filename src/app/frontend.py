@@ -1,11 +1,13 @@
 from fastapi import FastAPI, Request, Header, Response, Form, Depends, BackgroundTasks, HTTPException
 from app.db import get_db
 from sqlmodel import Session
-from app.crud import update_oauth_code, get_posts_for_member, get_posts_public, get_actor_or_create
+from app.crud import update_oauth_code, get_posts_for_member, get_posts_public, get_actor_or_create, PAGE_SIZE, \
+get_threads
+from app.search import search_posts_for_member
 import asyncio
 from app.common import get_config, is_valid_group_name
 from nicegui import Client, ui
-from typing import Dict, Any
+from typing import Dict, Any, List
 from PIL import Image
 import pytz
 import hashlib
@@ -42,17 +44,26 @@ def format_time(date_time, time_zone):
     time_zone_format = create_timezone_from_minutes(time_zone)
     return date_time.astimezone(time_zone_format).strftime("%m/%d/%Y, %H:%M:%S")
 
-def get_comments_tree(comments) -> Dict[str, Any]:
-    """Build a dict tree of a post and its comments
+def get_comments_trees(db, posts) -> List[Dict[str, Any]]:
+    """Build a dict tree of each post and its comments
+
+    All the trees are loaded together with a fixed number of queries, however many comments they have.
 
     Args:
-        comments (Boost): A boost class
+        db (Session): the db session
+        posts (List[Boost]): Boosts at the top of the trees
 
     Returns:
-        Dict[str, Any]: A dict containging the data for the node and its children with the same data
+        List[Dict[str, Any]]: For each post, a dict containging the data for the node and its children with the same data
     """
-    comment_root = {"comments": []}
-    stack = [(comments, comment_root)]
+    threads = get_threads(db, [post.id for post in posts])
+    nodes = {node.id: node for node in threads.get(None, [])}
+    comment_roots = []
+    stack = []
+    for post in posts:
+        comment_root = {"comments": []}
+        comment_roots.append(comment_root)
+        stack.append((nodes[post.id], comment_root))
 
     while len(stack) > 0:
         node, comment_dict = stack.pop()
@@ -71,11 +82,32 @@ def get_comments_tree(comments) -> Dict[str, Any]:
         }
         comment_dict["comments"] = []
 
-        for child in node.comments:
+        for child in threads.get(node.id, []):
             child_dict = {}
             stack.append((child, child_dict))
             comment_dict["comments"].append(child_dict)
-    return comment_root
+    return comment_roots
+
+def paged_posts(ui, db, get_page, time_zone, color_theme) -> None:
+    """Show the first page of a timeline with a button that appends the next one
+
+    Args:
+        get_page: Called with the (created_at, id) of the last shown post, or None, returns the next page of boosts
+    """
+    posts = ui.column().classes('w-full')
+    state = {"before": None}
+
+    def load_more():
+        page = get_page(state["before"])
+        with posts:
+            for comments_tree in get_comments_trees(db, page):
+                post_card(ui, comments_tree, time_zone, color_theme)
+        if len(page) > 0:
+            state["before"] = (page[-1].created_at, page[-1].id)
+        more_button.set_visibility(len(page) == PAGE_SIZE)
+
+    more_button = ui.button('Load more', on_click=load_more).props('flat')
+    load_more()
 
 def get_avatar(db, actor_handle):
     actor = get_actor_or_create(db, actor_handle)
@@ -319,6 +351,8 @@ def init(app: FastAPI) -> None:
             with ui.tabs() as tabs:
                 ui.tab('Home', icon='home')
                 ui.tab('All', icon='public')
+                if await is_authenticated(ui):
+                    ui.tab('Search', icon='search')
                 ui.tab('About', icon='info')
 
 
@@ -442,16 +476,26 @@ def init(app: FastAPI) -> None:
         with ui.tab_panels(tabs, value='Home').classes("w-full"):
             if await is_authenticated(ui):
                 with ui.tab_panel("Home").style('border-radius: 50%; height: 800px; width: 100%; max-width: 640px;'):
-                    for post_db in get_posts_for_member(db, await get_username(ui)):
-                        comments = []
-                        comments_tree = get_comments_tree(post_db)
-                        post_card(ui, comments_tree, time_zone, COLOR_THEME_LIGHT)
+                    username = await get_username(ui)
+                    paged_posts(ui, db, lambda before: get_posts_for_member(db, username, before), time_zone, COLOR_THEME_LIGHT)
 
                 with ui.tab_panel("All").style('border-radius: 50%; height: 800px; width: 100%; max-width: 640px;'):
-                    for post_db in get_posts_public(db, await get_username(ui)):
-                        comments = []
-                        comments_tree = get_comments_tree(post_db)
-                        post_card(ui, comments_tree, time_zone, COLOR_THEME_LIGHT)
+                    paged_posts(ui, db, lambda before: get_posts_public(db, username, before), time_zone, COLOR_THEME_LIGHT)
+
+                with ui.tab_panel("Search").style('border-radius: 50%; height: 800px; width: 100%; max-width: 640px;'):
+                    def run_search():
+                        search_results.clear()
+                        with search_results:
+                            results = search_posts_for_member(db, username, search_input.value)
+                            if len(results) == 0:
+                                ui.label("No posts found")
+                            for comments_tree in get_comments_trees(db, [post_db for post_db, rank in results]):
+                                post_card(ui, comments_tree, time_zone, COLOR_THEME_LIGHT)
+
+                    with ui.row().classes('w-full items-center'):
+                        search_input = ui.input(placeholder='Search your groups').classes('flex-grow').on('keydown.enter', run_search)
+                        ui.button(on_click=run_search).props('flat icon=search')
+                    search_results = ui.column().classes('w-full')
             else:
 
                 def login_panel():
@@ -1,51 +1,16 @@
-import requests
+import asyncio
 from urllib.parse import urlparse
-from app.common import SERVER_URL, get_group_path, SERVER_DOMAIN
-
-def webfinger(actor_handle):
-    # Remove proceeding @ if needed
-    if actor_handle.startswith("@"):
-        actor_handle = actor_handle[1:]
-
-    if "@" not in actor_handle:
-        print("actor handle has no @")
-        return
-    
-    host = actor_handle.split("@")[1]
-
-    if host == SERVER_DOMAIN:
-        user = actor_handle.split("@")[0]
-        return {"result": "local", "actor_url": get_group_path(user)}
-
-    url = "https://" + host + "/.well-known/webfinger?resource=acct:" + actor_handle
-
-    print("Getting: " + str(url))
-
-    r = requests.get(url)
-    data = []
-    try:
-        data = r.json()
-    except requests.JSONDecodeError:
-        print("Error, failed to decode webfinger: " + str(url))
-    data["result"] = "remote"
-    return data
+from sqlmodel import select
+from app.common import SERVER_URL, SERVER_DOMAIN
+from app.db import Actor, SessionLocal
+from app.actor_cache import get_actor, get_actor_async
+from app.remote_objects import get_object
+from app.webfinger_cache import resolve
 
 def get_actor_url(actor_handle: str) -> str:
-    data = webfinger(actor_handle)
-    
-    if data["result"] == "local":
-        return data["actor_url"]
-
-    links = data["links"]
-    for link in links:
-        if type(link) == dict and "rel" in link.keys() and "type" in link.keys() and "href" in link.keys():
-            if link["rel"] == "self" and link["type"] == "application/activity+json":
-                return link["href"]
-        
-    return
+    return resolve(actor_handle)
 
-def get_actor_inbox(actor_url, shared=False):
-    data = get_profile(actor_url)
+def inbox_from_profile(data, shared=False):
     inbox = data.get("inbox", None)
     if shared:
         if "endpoints" in data.keys():
@@ -56,26 +21,29 @@ def get_actor_inbox(actor_url, shared=False):
         print("Error: no inbox field in actor url")
     return inbox
 
+def shared_inbox_from_profile(data):
+    """Returns the sharedInbox endpoint of an actor, None if it has none"""
+    endpoints = data.get("endpoints", None)
+    if not isinstance(endpoints, dict):
+        return None
+    return endpoints.get("sharedInbox", None)
+
+def get_actor_inbox(actor_url, shared=False):
+    data = get_profile(actor_url)
+    return inbox_from_profile(data, shared)
+
+async def get_actor_inbox_async(actor_url, shared=False):
+    data = await get_profile_async(actor_url)
+    return inbox_from_profile(data, shared)
+
 def get_profile(actor_url):
-    # TODO: make this s generic function that get_profile and get_federated_note use
-    headers = {
-        'Accept': 'application/activity+json',
-    }
-    r = requests.get(actor_url, headers=headers)
-    data = None
-    try:
-        data = r.json()
-    except requests.JSONDecodeError as e:
-        import traceback
-        traceback.format_exc()
-        print("Error, failed to decode: " + str(actor_url))
+    return get_actor(actor_url)
 
-    return data
+async def get_profile_async(actor_url):
+    return await get_actor_async(actor_url)
 
-def actor_to_address_format(actor_url):
-    if actor_url == "https://www.w3.org/ns/activitystreams#Public":
-        return
-    
+def local_actor_to_address_format(actor_url):
+    """Returns the handle of a local group url without going to the network, None if not local"""
     parsed = urlparse(actor_url)
     host = parsed.netloc
 
@@ -84,14 +52,50 @@ def actor_to_address_format(actor_url):
         if actor_url.startswith(group_url):
             handle = actor_url.split(group_url + "/")[1]
             return handle + "@" + SERVER_DOMAIN
-            
-
-    data = get_profile(actor_url)
+    return
 
-    if "preferredUsername" not in data.keys():
+def address_from_profile(actor_url, data):
+    if data is None or "preferredUsername" not in data.keys():
         return
-    
+
+    host = urlparse(actor_url).netloc
     return data["preferredUsername"] + "@" + host
 
+def known_actor_to_address_format(actor_url):
+    """Returns the handle of an actor we already stored, one indexed lookup and no network"""
+    db = SessionLocal()
+    try:
+        return db.exec(select(Actor.name).where(Actor.uri == actor_url)).first()
+    finally:
+        db.close()
+
+def actor_to_address_format(actor_url):
+    if actor_url == "https://www.w3.org/ns/activitystreams#Public":
+        return
+
+    local_handle = local_actor_to_address_format(actor_url)
+    if local_handle is not None:
+        return local_handle
+
+    known_handle = known_actor_to_address_format(actor_url)
+    if known_handle is not None:
+        return known_handle
+
+    return address_from_profile(actor_url, get_profile(actor_url))
+
+async def actor_to_address_format_async(actor_url):
+    if actor_url == "https://www.w3.org/ns/activitystreams#Public":
+        return
+
+    local_handle = local_actor_to_address_format(actor_url)
+    if local_handle is not None:
+        return local_handle
+
+    known_handle = await asyncio.to_thread(known_actor_to_address_format, actor_url)
+    if known_handle is not None:
+        return known_handle
+
+    return address_from_profile(actor_url, await get_profile_async(actor_url))
+
 def get_federated_note(node_id):
-    return get_profile(node_id)
+    return get_object(node_id)
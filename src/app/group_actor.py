@@ -0,0 +1,133 @@
+"""Cached ActivityPub actor documents of the groups
+
+Every server that sees a group fetches its actor document, and fetches it again when a
+signature check misses its key cache. The document is rendered and serialized once and
+kept in memory with an ETag derived from its content, so a request is a dictionary lookup
+and a client that sends the ETag back in If-None-Match gets a 304.
+
+Entries are keyed by a fingerprint of the group fields, a changed group is rendered
+again on its next request without anything having to invalidate it.
+"""
+import hashlib
+import json
+import os
+from typing import Any, Dict, Optional
+
+from app.cache import TTLCache
+from app.common import get_config, get_context, SERVER_URL
+from app.db import Group
+from app.make_ssh_key import generate_keys
+
+config = get_config()
+CACHE_CONFIG = config.get("cache", None) or {}
+
+GROUP_ACTOR_TTL = CACHE_CONFIG.get("group_actor_ttl", 3600)
+GROUP_ACTOR_MEMORY_SIZE = CACHE_CONFIG.get("group_actor_memory_size", 1000)
+# How long remote servers may reuse the document without asking again
+GROUP_ACTOR_MAX_AGE = CACHE_CONFIG.get("group_actor_max_age", 300)
+
+DEFAULT_ICON = f"{SERVER_URL}/static/default_group_icon.png"
+
+_documents = TTLCache(GROUP_ACTOR_MEMORY_SIZE, GROUP_ACTOR_TTL)
+_public_key_pem: Optional[str] = None
+
+
+class GroupActorDocument:
+    """A rendered actor document, its serialized body and ETag"""
+
+    def __init__(self, data: Dict[str, Any]) -> None:
+        self.data = data
+        self.body = json.dumps(data)
+        self.etag = '"' + hashlib.sha256(self.body.encode("utf-8")).hexdigest()[:32] + '"'
+
+
+def get_default_gpg() -> str:
+    """The public key of the groups, read from disk once and created if there is none"""
+    global _public_key_pem
+    if _public_key_pem is not None:
+        return _public_key_pem
+    default_gpg_path = os.path.join(config["main"]["data_folder"], "default_gpg_key")
+    private_default_gpg_path = os.path.join(default_gpg_path, "id_rsa")
+    public_default_gpg_path = os.path.join(default_gpg_path, "id_rsa.pub")
+    if not os.path.isfile(private_default_gpg_path):
+        print("No default gpg key, creating one")
+        generate_keys(default_gpg_path)
+    with open(public_default_gpg_path, encoding="utf-8") as f:
+        _public_key_pem = f.read()
+    return _public_key_pem
+
+
+def group_fingerprint(group: Group) -> str:
+    """Changes whenever a field shown in the actor document changes"""
+    fields = [group.name, group.display_name, group.description, group.profile_picture, group.cover_photo,
+              group.discoverable]
+    return hashlib.sha256(json.dumps(fields).encode("utf-8")).hexdigest()
+
+
+def render_group_actor(group: Group) -> Dict[str, Any]:
+    id = group.name
+    group_url = SERVER_URL + "/group/" + id
+
+    icon = {"type": "Image", "url": f"{SERVER_URL}{group.profile_picture}"}
+    if group.profile_picture == "default":
+        icon = {"type": "Image", "url": DEFAULT_ICON}
+
+    image = {"type": "Image", "url": f"{SERVER_URL}{group.cover_photo}"}
+    if group.cover_photo == "default":
+        image = {"type": "Image", "url": DEFAULT_ICON}
+
+    return {
+        "@context": get_context(),
+        "id": group_url,
+        # This is an equivelent of a "Persion"
+        "type": "Person",
+        "following": group_url + "/following",
+        "followers": group_url + "/followers",
+        "inbox": group_url + "/inbox",
+        "outbox": "None",
+        "featured": group_url + "/featured",
+        # Note preferredUsername has to be the same as name
+        "preferredUsername": id,
+        "name": group.name,
+        "summary": group.description,
+        "url": group_url,
+        "publicKey": {"id": group_url + "#main-key", "owner": SERVER_URL + "/" + id, "publicKeyPem": get_default_gpg()},
+        "tag": [],
+        "attachment": [],
+        "endpoints": {
+            "oauthAuthorizationEndpoint": SERVER_URL + "/oauth/authorize",
+            "oauthRegistrationEndpoint": SERVER_URL + "/api/v1/apps",
+            "oauthTokenEndpoint": SERVER_URL + "/oauth/token",
+            "sharedInbox": SERVER_URL + "/inbox",
+            "uploadMedia": SERVER_URL + "/api/ap/upload_media",
+        },
+        "icon": icon,
+        "image": image,
+        "manuallyApprovesFollowers": False,
+        "discoverable": group.discoverable,
+    }
+
+
+def get_group_actor(group: Group) -> GroupActorDocument:
+    """Returns the actor document of a group, rendering it only if the group changed since"""
+    key = (group.name, group_fingerprint(group))
+    document = _documents.get(key)
+    if document is None:
+        document = GroupActorDocument(render_group_actor(group))
+        _documents.set(key, document)
+    return document
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header lists the ETag, weak comparison as RFC 9110 asks for"""
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
@@ -0,0 +1,125 @@
+"""Shared HTTP client for all federation fetches and deliveries
+
+A single httpx.AsyncClient lives on its own event loop thread. Async routes await it
+with the *_async helpers, sync code (crud, background tasks, fgctl) uses the blocking
+wrappers. Both go through the same keep-alive connection pools, so we only pay the
+TCP+TLS handshake once per remote host.
+"""
+import asyncio
+import threading
+from typing import Any, Coroutine, Optional
+
+import httpx
+
+from app.common import get_config, SERVER_URL
+
+config = get_config()
+HTTP_CONFIG = config.get("http", None) or {}
+
+CONNECT_TIMEOUT = HTTP_CONFIG.get("connect_timeout", 5)
+READ_TIMEOUT = HTTP_CONFIG.get("read_timeout", 20)
+WRITE_TIMEOUT = HTTP_CONFIG.get("write_timeout", 20)
+POOL_TIMEOUT = HTTP_CONFIG.get("pool_timeout", 10)
+MAX_CONNECTIONS = HTTP_CONFIG.get("max_connections", 100)
+MAX_KEEPALIVE_CONNECTIONS = HTTP_CONFIG.get("max_keepalive_connections", 20)
+KEEPALIVE_EXPIRY = HTTP_CONFIG.get("keepalive_expiry", 30)
+HTTP2 = HTTP_CONFIG.get("http2", True)
+
+USER_AGENT = f"fedigroup (+{SERVER_URL})"
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_client: Optional[httpx.AsyncClient] = None
+_lock = threading.Lock()
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    """Returns the event loop that owns the client, starting its thread if needed"""
+    global _loop
+    with _lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="fedigroup-http", daemon=True)
+            thread.start()
+            _loop = loop
+    return _loop
+
+
+def _get_client() -> httpx.AsyncClient:
+    # Only called from inside the client loop, so no locking needed
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            http2=HTTP2,
+            timeout=httpx.Timeout(connect=CONNECT_TIMEOUT, read=READ_TIMEOUT,
+                                  write=WRITE_TIMEOUT, pool=POOL_TIMEOUT),
+            limits=httpx.Limits(max_connections=MAX_CONNECTIONS,
+                                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                                keepalive_expiry=KEEPALIVE_EXPIRY),
+            headers={"User-Agent": USER_AGENT},
+            follow_redirects=True,
+        )
+    return _client
+
+
+def _in_client_loop() -> bool:
+    try:
+        return asyncio.get_running_loop() is _loop
+    except RuntimeError:
+        return False
+
+
+async def _request(method: str, url: str, **kwargs) -> httpx.Response:
+    return await _get_client().request(method, url, **kwargs)
+
+
+def run(coro: Coroutine) -> Any:
+    """Runs a coroutine on the client loop and blocks until it is done.
+    This is the sync wrapper used by crud code and fgctl.
+    """
+    loop = _get_loop()
+    if _in_client_loop():
+        coro.close()
+        raise RuntimeError("http_client.run() called from the client loop, await the coroutine instead")
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+
+async def run_async(coro: Coroutine) -> Any:
+    """Awaits a coroutine on the client loop from any other event loop"""
+    loop = _get_loop()
+    if _in_client_loop():
+        return await coro
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+
+async def request_async(method: str, url: str, **kwargs) -> httpx.Response:
+    return await run_async(_request(method, url, **kwargs))
+
+
+async def get_async(url: str, **kwargs) -> httpx.Response:
+    return await request_async("GET", url, **kwargs)
+
+
+async def post_async(url: str, **kwargs) -> httpx.Response:
+    return await request_async("POST", url, **kwargs)
+
+
+def request(method: str, url: str, **kwargs) -> httpx.Response:
+    return run(_request(method, url, **kwargs))
+
+
+def get(url: str, **kwargs) -> httpx.Response:
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> httpx.Response:
+    return request("POST", url, **kwargs)
+
+
+def close():
+    """Closes the pooled connections, used on shutdown"""
+    global _client
+    if _loop is None or _client is None:
+        return
+    client = _client
+    _client = None
+    asyncio.run_coroutine_threadsafe(client.aclose(), _loop).result()
@@ -1,6 +1,5 @@
 # Code to sign, handle and validate https
 # Some code taken from https://gitlab.com/bashrc2/epicyon/-/blob/main/httpsig.py
-import requests
 import json
 from urllib.parse import urlparse
 import base64
@@ -15,6 +14,7 @@ from cryptography.hazmat.primitives.serialization import load_pem_private_key
 from cryptography.hazmat.primitives.serialization import load_pem_public_key
 from time import gmtime, strftime
 import asyncio
+from app import http_client
 
 def get_sha_256(msg: str):
     """Returns a SHA256 hash of the given string
@@ -31,22 +31,124 @@ def message_content_digest(message_body_json_str: str,
     hash_result = get_sha_256(msg)
     return base64.b64encode(hash_result).decode('utf-8')
 
+def digest_matches_body(digest_header: str, body: bytes) -> bool:
+    """Returns true if the SHA-256 in a Digest header matches the body,
+    cheap enough to run before any signature work
+    """
+    expected = base64.b64encode(get_sha_256(body)).decode('utf-8')
+    for entry in digest_header.split(','):
+        algorithm, _, value = entry.strip().partition('=')
+        if algorithm.lower() == 'sha-256':
+            return value == expected
+    return False
+
+def http_date() -> str:
+    """Returns the current time in the format used by the Date header
+    """
+    return datetime.utcnow().strftime("%a, %d %b %Y %H:%M:%S GMT")
+
+
+class PreparedBody:
+    """A serialized activity with its digest, computed once and reused for
+    every inbox of a delivery batch.
+    """
+
+    def __init__(self, activity) -> None:
+        if isinstance(activity, str):
+            self.body = activity
+        else:
+            self.body = json.dumps(activity)
+        self.digest = 'SHA-256=' + message_content_digest(self.body, "rsa-sha256")
+
+
+class Signer:
+    """Signs http requests with one private key, the key file is read and
+    parsed once when the signer is created.
+    """
+
+    def __init__(self, key_id: str, key_path: str) -> None:
+        self.key_id = key_id
+        self.key_path = key_path
+        with open(key_path, 'rb') as fh:
+            key_data = fh.read()
+        self.key = load_pem_private_key(key_data,
+                                        None, backend=default_backend())
+
+    def prepare(self, activity) -> PreparedBody:
+        return PreparedBody(activity)
+
+    def signature_header(self, headers: dict) -> str:
+        """Returns the Signature header value for the given headers to sign
+        """
+        # build a digest for signing
+        signed_header_keys = headers.keys()
+        signed_header_text = '\n'.join(
+            [f'{header_key}: {headers[header_key]}' for header_key in signed_header_keys])
+        # signed_header_text.encode('ascii') matches
+        header_digest = get_sha_256(signed_header_text.encode('ascii'))
+
+        # Sign the digest
+        raw_signature = self.key.sign(header_digest,
+                                      padding.PKCS1v15(),
+                                      hazutils.Prehashed(hashes.SHA256()))
+        signature = base64.b64encode(raw_signature).decode('ascii')
+
+        # Put it into a valid HTTP signature format
+        algorithm = "rsa-sha256"
+        signature_dict = {
+            'keyId': self.key_id,
+            'algorithm': algorithm,
+            'headers': ' '.join(signed_header_keys),
+            'signature': signature
+        }
+        return ','.join(
+            [f'{k}="{v}"' for k, v in signature_dict.items()])
+
+    def post_headers(self, url: str, prepared: PreparedBody, date_str: str = None) -> dict:
+        """Returns the headers to POST a prepared body to url, only the
+        header string is signed here, the body digest is already computed.
+        """
+        parsed = urlparse(url)
+        host = parsed.netloc
+        if not date_str:
+            date_str = http_date()
+
+        signature = self.signature_header({
+            '(request-target)': f'post {parsed.path}',
+            'host': host,
+            'date': date_str,
+            'digest': prepared.digest,
+            'content-type': 'application/activity+json',
+        })
+        return {
+            "Host": host,
+            "Date": date_str,
+            "Signature": signature,
+            "digest": prepared.digest,
+            "Content-Type": "application/activity+json",
+        }
+
+
+_signers = {}
+
+def get_signer(key_id: str, key_path: str) -> Signer:
+    """Returns the signer for a key, each key is loaded from disk only once
+    """
+    signer = _signers.get((key_id, key_path), None)
+    if signer is None:
+        signer = Signer(key_id, key_path)
+        _signers[(key_id, key_path)] = signer
+    return signer
+
+
 def sign_post_headers(message_body_json_str, date_str, host, path, key_path, preshared_key_id):
     """Returns a raw signature string that can be plugged into a header and
     used to verify the authenticity of an HTTP transmission.
     """
-    # domain = get_full_domain(domain, port)
-    digest_algorithm = "rsa-sha256"
-
     if not date_str:
         date_str = strftime("%a, %d %b %Y %H:%M:%S %Z", gmtime())
 
-    key_data = None
-    with open(key_path, 'rb') as fh:
-        key_data=fh.read()
-
-
-    key_id = preshared_key_id
+    signer = get_signer(preshared_key_id, key_path)
     if not message_body_json_str:
         headers = {
             '(request-target)': f'get {path}',
@@ -54,77 +156,51 @@ def sign_post_headers(message_body_json_str, date_str, host, path, key_path, pre
             'date': date_str,
             'accept': "application/activity+json"
         }
-    else:
-        body_digest = \
-            message_content_digest(message_body_json_str, digest_algorithm)
-        digest_prefix = 'SHA-256'
-        headers = {
-            '(request-target)': f'post {path}',
-            'host': host,
-            'date': date_str,
-            'digest': f'{digest_prefix}={body_digest}',
-            'content-type': 'application/activity+json',
-        }
-    key = load_pem_private_key(key_data,
-                            None, backend=default_backend())
-    
-    # build a digest for signing
-    signed_header_keys = headers.keys()
-    signed_header_text = ''
-    for header_key in signed_header_keys:
-        signed_header_text += f'{header_key}: {headers[header_key]}\n'
-    # strip the trailing linefeed
-    signed_header_text = signed_header_text.rstrip('\n')
-    # signed_header_text.encode('ascii') matches
-    header_digest = get_sha_256(signed_header_text.encode('ascii'))
-    # print('header_digest2: ' + str(header_digest))
-
-    # Sign the digest
-    raw_signature = key.sign(header_digest,
-                             padding.PKCS1v15(),
-                             hazutils.Prehashed(hashes.SHA256()))
-    signature = base64.b64encode(raw_signature).decode('ascii')
-
-    # Put it into a valid HTTP signature format
-    algorithm="rsa-sha256"
-    signature_dict = {
-        'keyId': key_id,
-        'algorithm': algorithm,
-        'headers': ' '.join(signed_header_keys),
-        'signature': signature
+        return signer.signature_header(headers), None
+
+    prepared = PreparedBody(message_body_json_str)
+    headers = {
+        '(request-target)': f'post {path}',
+        'host': host,
+        'date': date_str,
+        'digest': prepared.digest,
+        'content-type': 'application/activity+json',
     }
-    signature_header = ','.join(
-        [f'{k}="{v}"' for k, v in signature_dict.items()])
-    a = digest_prefix + "=" + body_digest
-    return signature_header, a
+    return signer.signature_header(headers), prepared.digest
 
 def send_signed(url, activity, key_id, preshared_key_id):
-    parsed = urlparse(url)
-    domain = parsed.netloc.split(".")[-2:]
-    host = ".".join(domain)    
-
-    now = datetime.utcnow()
-    formatted_now = now.strftime("%a, %d %b %Y %H:%M:%S GMT")
-
-    body = json.dumps(activity)
-    sig, digest = sign_post_headers(body, formatted_now, host, parsed.path, key_id, preshared_key_id)
-
-    # await asyncio.sleep(5)
-
-    r = requests.post(url,
-        data=body,
-        headers={
-            "Host": host,
-            "Date": formatted_now,
-            "Signature": sig,
-            "digest": digest,
-            "Content-Type": "application/activity+json",
-        },
-    )
+    signer = get_signer(preshared_key_id, key_id)
+    prepared = signer.prepare(activity)
+    r = http_client.post(url, content=prepared.body, headers=signer.post_headers(url, prepared))
+    return r.content
 
+async def send_signed_async(url, activity, key_id, preshared_key_id):
+    signer = get_signer(preshared_key_id, key_id)
+    prepared = signer.prepare(activity)
+    r = await http_client.post_async(url, content=prepared.body, headers=signer.post_headers(url, prepared))
     return r.content
 
 
+def get_signature_key_id(headers: dict) -> str:
+    """Returns the keyId the request was signed with, None if there is no signature
+    headers - should be a dictionary of request headers
+    """
+    signature_header = headers.get('Signature-Input') or \
+        headers.get('signature-input')
+    field_sep = ';'
+    if not signature_header:
+        signature_header = headers.get('Signature') or headers.get('signature')
+        field_sep = ','
+    if not signature_header:
+        return None
+
+    for field in signature_header.split(field_sep):
+        if '=' not in field:
+            continue
+        key, value = field.split('=', 1)
+        if key.strip().lower() == 'keyid':
+            return value.strip().strip('"')
+    return None
 
 
 def _verify_recent_signature(signed_date_str: str) -> bool:
@@ -155,7 +231,8 @@ def verify_post_headers(http_prefix: str,
                         no_recency_check: bool = False) -> bool:
     """Returns true or false depending on if the key that we plugged in here
     validates against the headers, method, and path.
-    public_key_pem - the public key from an rsa key pair
+    public_key_pem - the public key from an rsa key pair, either as pem or
+    an already loaded key object
     headers - should be a dictionary of request headers
     path - the relative url that was requested from this site
     get_method - GET or POST
@@ -174,8 +251,11 @@ def verify_post_headers(http_prefix: str,
         print('verify_post_headers message_body_json_str: ' +
               str(message_body_json_str))
 
-    pubkey = load_pem_public_key(public_key_pem.encode('utf-8'),
-                                 backend=default_backend())
+    if isinstance(public_key_pem, str):
+        pubkey = load_pem_public_key(public_key_pem.encode('utf-8'),
+                                     backend=default_backend())
+    else:
+        pubkey = public_key_pem
     # pubkey = public_key_pem
     # Build a dictionary of the signature values
     if headers.get('Signature-Input') or headers.get('signature-input'):
@@ -0,0 +1,431 @@
+"""Handling of activities posted to our inboxes
+
+The inbox route either handles an activity right away, or in journal mode only does
+cheap checks, appends the raw request to the inbox_journal table and answers 202. A
+pool of processors then verifies and handles the journaled activities, so remote
+servers never wait on our profile fetches, RSA verification or database writes.
+"""
+import asyncio
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse
+
+from fastapi import BackgroundTasks
+from sqlalchemy import update, func
+from sqlmodel import select, Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.common import get_config, get_group_path, is_local_actor, get_handle_name, \
+get_default_gpg_private_key_path
+from app.crud import get_group_by_name, add_member_to_group, remove_member_grom_group, get_boost_by_note_id
+from app.db import InboxJournal, SessionLocal
+from app.get_federated_data import actor_to_address_format_async, get_profile_async, inbox_from_profile, \
+shared_inbox_from_profile
+from app.http_sig import send_signed_async, get_signature_key_id, digest_matches_body
+from app.key_cache import get_public_key
+from app.seen_activities import is_activity_seen, claim_activity, forget_activity
+from app.send_group import save_message_and_boost
+from app.verify_pool import verify_signature
+
+config = get_config()
+INBOX_CONFIG = config.get("inbox", None) or {}
+
+# "sync" handles activities in the request, "journal" stores them and answers 202
+MODE = INBOX_CONFIG.get("mode", "sync")
+PROCESSORS = INBOX_CONFIG.get("processors", 4)
+RUN_IN_APP = INBOX_CONFIG.get("run_in_app", True)
+POLL_INTERVAL = INBOX_CONFIG.get("poll_interval", 1)
+# How long a claimed entry is hidden from other processors before it is considered lost
+LEASE_TIMEOUT = INBOX_CONFIG.get("lease_timeout", 300)
+MAX_ATTEMPTS = INBOX_CONFIG.get("max_attempts", 5)
+RETRY_DELAY = INBOX_CONFIG.get("retry_delay", 60)
+
+
+async def send_follow_accept(inbox, accept_activity, preshared_key_id):
+    response = await send_signed_async(inbox, accept_activity, get_default_gpg_private_key_path(), preshared_key_id)
+    print(f"Got accept follow request: {response}")
+
+
+def check_inbox_request(headers: Dict[str, str], body_bytes: bytes) -> Optional[str]:
+    """Cheap checks done before accepting an activity, returns the error or None if it looks valid"""
+    if "signature" not in headers and "signature-input" not in headers:
+        return "Request is not signed"
+    if "digest" not in headers:
+        return "Request has no digest"
+    # Rejects tampered or broken bodies before any RSA work
+    if not digest_matches_body(headers["digest"], body_bytes):
+        return "Digest does not match the body"
+    try:
+        body = json.loads(body_bytes.decode())
+    except (ValueError, UnicodeDecodeError):
+        return "Body is not valid json"
+    if not isinstance(body, dict) or "actor" not in body or "type" not in body:
+        return "Body is not an activity"
+    return None
+
+
+async def handle_inbox_activity(db: Session, background_tasks: BackgroundTasks, path: str,
+                                headers: Dict[str, str], body_bytes: bytes, group: Optional[str] = None):
+    """Verify an activity posted to an inbox and act on it
+
+    Args:
+        db (Session): the db session
+        background_tasks (BackgroundTasks): Where to queue work done after handling
+        path (str): The path the activity was posted to, part of the signature
+        headers (Dict[str, str]): The request headers, with lower case names
+        body_bytes (bytes): The raw request body
+        group (Optional[str]): The group whose inbox got the activity, None for the shared inbox
+    """
+    body = json.loads(body_bytes.decode())
+    actor = body["actor"]
+    request_id = body.get("id", None)
+
+    # Retries and relayed copies stop here, before any fetch or signature check
+    if is_activity_seen(db, request_id):
+        print(f"Already got activity: {request_id}")
+        return "ok"
+
+    # Get the key the request was signed with
+    key_id = get_signature_key_id(headers)
+    public_key = None
+    if key_id is not None:
+        public_key = await get_public_key(key_id)
+    if public_key is None:
+        print("No key for actor")
+        print(body)
+        return "No key for actor"
+    if public_key.owner != actor:
+        print(f"Key {key_id} is not owned by {actor}")
+        return "Signature was not valid"
+    digest = headers["digest"]
+
+    verify_result = await verify_signature(public_key.pem, public_key.key, headers, path, digest,
+                                           body_bytes.decode())
+
+    if not verify_result:
+        # The actor might have rotated its key, refetch it once
+        refreshed_key = await get_public_key(key_id, refresh=True)
+        if refreshed_key is not None and refreshed_key.pem != public_key.pem and refreshed_key.owner == actor:
+            verify_result = await verify_signature(refreshed_key.pem, refreshed_key.key, headers, path, digest,
+                                                   body_bytes.decode())
+
+    if not verify_result:
+        print("Signature was not valid")
+        return "Signature was not valid"
+
+    print("Signiture is valid")
+
+    # A server may only claim ids on its own host, or it could burn the ids of another server's activities
+    claim_id = request_id
+    if request_id is not None and urlparse(request_id).netloc != urlparse(actor).netloc:
+        print(f"Activity {request_id} is not on the host of {actor}, not deduplicating it")
+        claim_id = None
+
+    if not claim_activity(db, claim_id):
+        print(f"Already got activity: {request_id}")
+        return "ok"
+
+    try:
+        return await handle_verified_activity(db, background_tasks, body, group, claim_id)
+    except Exception:
+        # Let a retried delivery handle it again
+        forget_activity(db, claim_id)
+        raise
+
+
+def store_mentioned_note(object_created: Dict[str, Any], local_mentions: List[str], claim_id: Optional[str]) -> None:
+    """Store a note that mentions our groups and boost it, run after the inbox answered
+
+    A failure forgets the activity id so a redelivery is handled again.
+    """
+    db = SessionLocal()
+    try:
+        save_message_and_boost(db, object_created, local_mentions)
+    except Exception:
+        forget_activity(db, claim_id)
+        raise
+    finally:
+        db.close()
+
+
+async def handle_verified_activity(db: Session, background_tasks: BackgroundTasks, body: Dict[str, Any],
+                                   group: Optional[str] = None, claim_id: Optional[str] = None):
+    """Act on an activity whose signature was verified
+
+    Args:
+        db (Session): the db session
+        background_tasks (BackgroundTasks): Where to queue work done after handling
+        body (Dict[str, Any]): The activity
+        group (Optional[str]): The group whose inbox got the activity, None for the shared inbox
+        claim_id (Optional[str]): The activity id claimed as seen, forgotten if queued work fails
+    """
+    request_id = body.get("id", None)
+    request_type = body.get("type", None)
+    requesting_actor = body.get("actor", None)
+    object = body.get("object", None)
+
+    print("got type: " + str(request_type))
+
+    if request_type == "Follow":
+        print("Got follow request")
+
+        # requesting_actor = object.get("actor", None)
+        requesting_profile = await get_profile_async(requesting_actor)
+        inbox = inbox_from_profile(requesting_profile)
+        preshared_key_id = get_group_path(group) + "#main-key"
+
+        # Add to follower collection, with where to deliver to it
+        member_relation = {
+            "group": group,
+            "member": await actor_to_address_format_async(requesting_actor),
+            "actor_url": requesting_actor,
+            "inbox": inbox,
+            "shared_inbox": shared_inbox_from_profile(requesting_profile),
+            }
+        result = add_member_to_group(db=db, item=member_relation)
+
+        accept_activity = {
+            '@context': 'https://www.w3.org/ns/activitystreams', 
+            'id': get_group_path(group) + '#accepts/follows/' + str(time.time()),
+            'type': 'Accept',
+            'actor': get_group_path(group),
+            'object': {
+                'id': request_id,
+                'type': 'Follow',
+                'actor': requesting_actor,
+                'object': get_group_path(group)
+                }
+        }
+
+        if result is not None:
+            # Send back accept
+
+            # response = await send_signed(inbox, accept_activity, get_default_gpg_private_key_path(), preshared_key_id)
+            # print(response)
+            background_tasks.add_task(send_follow_accept, inbox, accept_activity, preshared_key_id)
+        else:
+            print("Error: got none reply for add_member_to_group")
+
+    elif request_type == "Accept":
+        print("Got accepted!")
+        print(object)
+        # send_signed()
+        # TODO: Add add following to db
+    elif request_type == "Undo":
+        print("Got unfollow request")
+        # Add to follower collection
+        member_relation = {
+            "group": group,
+            "member": await actor_to_address_format_async(requesting_actor)
+            }
+        result = remove_member_grom_group(db=db, item=member_relation)
+        # background_tasks.add_task(send_follow_accept, inbox, accept_activity, preshared_key_id)
+    elif request_type == "Announce":
+        note_boosted = body["object"]
+        print("Got a boost to status: " + str(note_boosted))
+        #TODO handle boost addition to db
+
+        print(json.dumps(body))
+
+    elif request_type == "Create":
+        object_created = body.get("object", None)
+        object_created_type = object_created.get("type", None)
+        if object_created_type == "Note":
+            object_id = object_created["id"]
+
+            tags = object_created["tag"]
+
+            mentions = []
+
+            for tag in tags:
+                tag_id = tag["href"]
+                if tag["type"] == "Mention":
+                    local_actor = await actor_to_address_format_async(tag_id)
+                    if local_actor is not None:
+                        if local_actor not in mentions:
+                            mentions.append(local_actor)
+
+            local_mentions = []
+            for mention in mentions:
+                if is_local_actor(mention):
+                    group = get_handle_name(mention)
+                    group_db = get_group_by_name(db, group)
+                    if group_db is not None:
+                        print("Got mention!")
+                        local_mentions.append(group)
+
+            if len(local_mentions) > 0:
+                print("Add boost to db and handle mentions")
+                boost_db = get_boost_by_note_id(db, note_id=object_id)
+                if boost_db is None:
+                    print(f"processing: {object_id}")
+                    background_tasks.add_task(store_mentioned_note, object_created, local_mentions, claim_id)
+                else:
+                    print(f"Already got: {object_id}")
+                return "ok"
+    elif request_type == "Delete":
+        print("Got delete request, unimplemented")
+
+
+    else:
+        print("Got unhandled request type: " + str(body))
+        print("request type: " + str(request_type))
+
+    return
+
+
+class ClaimedEntry:
+    """A journaled request a processor owns until it records the result"""
+
+    def __init__(self, id: int, group_name: Optional[str], path: str, headers: Dict[str, str], body: str, attempts: int) -> None:
+        self.id = id
+        self.group_name = group_name
+        self.path = path
+        self.headers = headers
+        self.body = body
+        self.attempts = attempts
+
+
+def journal_inbox_request(db: Session, path: str, headers: Dict[str, str], body_bytes: bytes, group: Optional[str] = None) -> InboxJournal:
+    """Append a raw inbox request to the journal for the processors"""
+    entry = InboxJournal(
+        group_name=group,
+        path=path,
+        headers=headers,
+        body=body_bytes.decode(),
+    )
+    db.add(entry)
+    db.commit()
+    return entry
+
+
+async def journal_inbox_request_async(db: AsyncSession, path: str, headers: Dict[str, str], body_bytes: bytes,
+                                      group: Optional[str] = None) -> InboxJournal:
+    """Same as journal_inbox_request, on an async session"""
+    entry = InboxJournal(
+        group_name=group,
+        path=path,
+        headers=headers,
+        body=body_bytes.decode(),
+    )
+    db.add(entry)
+    await db.commit()
+    return entry
+
+
+def claim_inbox_entries(limit: int = 1) -> List[ClaimedEntry]:
+    """Claim due journal entries, rows locked by another processor are skipped"""
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        rows = db.exec(select(InboxJournal)
+                       .where(InboxJournal.processed_at == None)
+                       .where(InboxJournal.failed_at == None)
+                       .where(InboxJournal.next_attempt_at <= now)
+                       .order_by(InboxJournal.next_attempt_at)
+                       .limit(limit)
+                       .with_for_update(skip_locked=True)).all()
+
+        claimed = []
+        for row in rows:
+            # Hide it from the other processors while we handle it
+            row.next_attempt_at = now + timedelta(seconds=LEASE_TIMEOUT)
+            claimed.append(ClaimedEntry(row.id, row.group_name, row.path, row.headers, row.body, row.attempts))
+        db.commit()
+        return claimed
+    finally:
+        db.close()
+
+
+def record_inbox_result(entry: ClaimedEntry, error: Optional[str] = None) -> None:
+    """Mark a claimed entry as processed, or schedule its retry"""
+    now = datetime.utcnow()
+    if error is None:
+        values = {"processed_at": now, "last_error": None}
+    else:
+        attempts = entry.attempts + 1
+        values = {"attempts": attempts, "last_error": error[:1000]}
+        if attempts < MAX_ATTEMPTS:
+            values["next_attempt_at"] = now + timedelta(seconds=RETRY_DELAY * attempts)
+        else:
+            print(f"Giving up inbox entry {entry.id}: {error}")
+            values["failed_at"] = now
+
+    db = SessionLocal()
+    try:
+        db.execute(update(InboxJournal).where(InboxJournal.id == entry.id).values(**values))
+        db.commit()
+    finally:
+        db.close()
+
+
+def get_inbox_queue_depth(db: Session) -> int:
+    return db.exec(select(func.count(InboxJournal.id))
+                   .where(InboxJournal.processed_at == None)
+                   .where(InboxJournal.failed_at == None)).one()
+
+
+async def process_entry(entry: ClaimedEntry) -> None:
+    """Verify and handle one journaled request"""
+    db = SessionLocal()
+    error = None
+    try:
+        background_tasks = BackgroundTasks()
+        await handle_inbox_activity(db, background_tasks, entry.path, entry.headers,
+                                    entry.body.encode(), entry.group_name)
+        await background_tasks()
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        print(f"Error processing inbox entry {entry.id}: {error}")
+    finally:
+        db.close()
+    await asyncio.to_thread(record_inbox_result, entry, error)
+
+
+class InboxProcessorPool:
+    """Processors draining the inbox journal
+
+    Each processor runs in its own thread with its own event loop, the handling still
+    makes blocking database calls and this keeps them off the web server's loop.
+
+    Args:
+        processors (int): Number of activities handled at once
+    """
+
+    def __init__(self, processors: int = PROCESSORS) -> None:
+        self.processors = processors
+        self._threads: List[threading.Thread] = []
+        self._stopping = threading.Event()
+
+    async def _processor(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                claimed = await asyncio.to_thread(claim_inbox_entries, 1)
+                if len(claimed) == 0:
+                    await asyncio.sleep(POLL_INTERVAL)
+                    continue
+                for entry in claimed:
+                    await process_entry(entry)
+            except Exception as e:
+                # Keep the processor alive, the lease makes sure the entry is retried
+                print(f"Error in inbox processor: {e}")
+                await asyncio.sleep(POLL_INTERVAL)
+
+    def start(self) -> None:
+        self._stopping.clear()
+        for i in range(self.processors):
+            thread = threading.Thread(target=asyncio.run, args=(self._processor(),),
+                                      name=f"fedigroup-inbox-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self) -> None:
+        self._stopping.set()
+        self._threads = []
+
+    def join(self) -> None:
+        for thread in self._threads:
+            thread.join()
@@ -0,0 +1,111 @@
+"""Cache of remote public keys used to verify inbox signatures
+
+Keys are cached by keyId as already loaded key objects, so a signature check for a
+known sender needs neither a network call nor PEM parsing. Concurrent misses for the
+same keyId share a single fetch, and a keyId is refetched at most once per
+key_refresh_interval however many signatures fail against it.
+"""
+import asyncio
+from typing import Any, Dict, Optional, Tuple
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.serialization import load_pem_public_key
+
+from app.actor_cache import get_actor_async
+from app.cache import TTLCache
+from app.common import get_config
+
+config = get_config()
+CACHE_CONFIG = config.get("cache", None) or {}
+
+KEY_TTL = CACHE_CONFIG.get("key_ttl", 86400)
+KEY_MEMORY_SIZE = CACHE_CONFIG.get("key_memory_size", 5000)
+KEY_REFRESH_INTERVAL = CACHE_CONFIG.get("key_refresh_interval", 60)
+
+_keys = TTLCache(KEY_MEMORY_SIZE, KEY_TTL)
+# keyIds refetched within the last key_refresh_interval
+_refreshed = TTLCache(KEY_MEMORY_SIZE, KEY_REFRESH_INTERVAL)
+# Fetches in flight, keyed by event loop too since the inbox processors each run their own
+_pending: Dict[Tuple[asyncio.AbstractEventLoop, str, bool], asyncio.Future] = {}
+
+
+class PublicKey:
+    """A remote public key and the actor that owns it"""
+
+    def __init__(self, key_id: str, owner: str, pem: str, key: Any) -> None:
+        self.key_id = key_id
+        self.owner = owner
+        self.pem = pem
+        self.key = key
+
+
+def _key_data_from_document(key_id: str, document: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    # Mastodon style: the keyId points into the actor document
+    public_keys = document.get("publicKey", None)
+    if public_keys is not None:
+        if isinstance(public_keys, dict):
+            public_keys = [public_keys]
+        for public_key in public_keys:
+            if isinstance(public_key, dict) and public_key.get("id", key_id) == key_id:
+                public_key = dict(public_key)
+                public_key.setdefault("owner", document.get("id", None))
+                return public_key
+        return None
+
+    # The keyId is a standalone key document
+    if "publicKeyPem" in document:
+        return document
+    return None
+
+
+async def _fetch_public_key(key_id: str, refresh: bool) -> Optional[PublicKey]:
+    document_url = key_id.split("#")[0]
+    document = await get_actor_async(document_url, refresh=refresh)
+    if document is None:
+        print(f"Error: could not fetch key {key_id}")
+        return None
+
+    key_data = _key_data_from_document(key_id, document)
+    if key_data is None or "publicKeyPem" not in key_data:
+        print(f"Error: no public key {key_id} in {document_url}")
+        return None
+
+    pem = key_data["publicKeyPem"]
+    try:
+        key = load_pem_public_key(pem.encode('utf-8'), backend=default_backend())
+    except ValueError:
+        print(f"Error: could not load public key {key_id}")
+        return None
+
+    public_key = PublicKey(key_id, key_data.get("owner", None), pem, key)
+    _keys.set(key_id, public_key)
+    return public_key
+
+
+async def get_public_key(key_id: str, refresh: bool = False) -> Optional[PublicKey]:
+    """Returns the loaded public key for a keyId
+
+    Args:
+        key_id (str): The keyId from the signature header
+        refresh (bool): Refetch the key even if it is cached, used after a failed verification
+            so key rotation is picked up. Ignored if the key was refetched within key_refresh_interval
+
+    Returns:
+        Optional[PublicKey]: The key, None if it could not be fetched
+    """
+    if refresh and key_id in _refreshed:
+        refresh = False
+    if not refresh:
+        public_key = _keys.get(key_id)
+        if public_key is not None:
+            return public_key
+    else:
+        _refreshed.set(key_id, True)
+
+    pending_key = (asyncio.get_running_loop(), key_id, refresh)
+    pending = _pending.get(pending_key, None)
+    if pending is None:
+        pending = asyncio.ensure_future(_fetch_public_key(key_id, refresh))
+        _pending[pending_key] = pending
+        pending.add_done_callback(lambda _: _pending.pop(pending_key, None))
+    return await asyncio.shield(pending)
@@ -1,27 +1,32 @@
 import re
-from fastapi import FastAPI, Request, Header, Response, Form, Depends, BackgroundTasks, HTTPException
+from fastapi import FastAPI, Request, Header, Response, Form, Depends, BackgroundTasks, HTTPException, Query
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 from typing import Optional, List
 # from sqlalchemy.orm import Session
 from sqlmodel import Session
-from app.make_ssh_key import generate_keys
 
-from app.crud import get_group_by_name, create_group, add_member_to_group, remove_member_grom_group, \
-get_members_list, get_note, get_groups, create_federated_note, get_boost_by_note_id, \
-update_oauth_code, get_settings_secret, get_actor_or_create, get_recipients_from_note
+from app.crud import get_group_by_name, create_group, get_groups, create_federated_note, \
+update_oauth_code, get_settings_secret, get_actor_or_create, get_recipients_from_note, get_posts_for_member, \
+get_posts_public, PAGE_SIZE, get_group_by_name_async, get_note_async
 
-from app.db import Group, Members, SessionLocal, database
-from app.common import get_config, DIR, as_form, get_group_path, SERVER_DOMAIN, SERVER_URL, datetime_str, \
-is_local_actor, get_handle_name, init_fs, is_valid_group_name
+from app.db import Group, Members, SessionLocal, AsyncSessionLocal, async_engine
+from app.common import get_config, DIR, as_form, SERVER_DOMAIN, SERVER_URL, datetime_str, init_fs, \
+is_valid_group_name, encode_cursor, decode_cursor, get_context
 
 from app.schemas import GroupCreateForm, OauthLogin
-from app.send_group import save_message_and_boost
 import json
-from app.http_sig import send_signed, verify_post_headers
-from app.get_federated_data import get_actor_inbox, actor_to_address_format, get_profile, get_actor_url
-import time
+from app.get_federated_data import get_actor_url
+from app import http_client, verify_pool
+from app.delivery_queue import DeliveryWorkerPool, RUN_IN_APP as RUN_DELIVERY_IN_APP, get_pending_deliveries_count
+from app.inbox import InboxProcessorPool, MODE as INBOX_MODE, RUN_IN_APP as RUN_INBOX_IN_APP, \
+check_inbox_request, journal_inbox_request_async, handle_inbox_activity, get_inbox_queue_depth
+from app.seen_activities import is_activity_seen_async
+from app.group_actor import get_group_actor, etag_matches, GROUP_ACTOR_MAX_AGE
+from app.followers import render_followers, CACHE_TTL as FOLLOWERS_CACHE_TTL
+from app.search import search_posts_for_member, MAX_RESULTS as MAX_SEARCH_RESULTS
+import asyncio
 import os.path
 from urllib.parse import urlparse
 import starlette
@@ -36,19 +41,21 @@ from fastapi_another_jwt_auth import AuthJWT
 from fastapi_another_jwt_auth.exceptions import AuthJWTException
 import app.frontend as frontend
 
-from app.db import get_db
+from app.db import get_db, get_async_db
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 config = get_config()
 SERVER_DOMAIN = config["main"]["server_url"]
 UPLOAD_FOLDER = config["main"]["upload_folder"]
 SERVER_URL = "https://" + SERVER_DOMAIN
-DEFAULT_ICON = f"{SERVER_URL}/static/default_group_icon.png"
 
 from app.db import SessionLocal, init_db
 init_db(SessionLocal)
 init_fs()
 
 app = FastAPI()
+delivery_workers = DeliveryWorkerPool()
+inbox_processors = InboxProcessorPool()
 
 templates = Jinja2Templates(directory=os.path.join(DIR, "templates"))
 app.mount("/static", StaticFiles(directory=os.path.join(DIR, "static")), name="static")
@@ -56,30 +63,20 @@ app.mount("/uploads", StaticFiles(directory=UPLOAD_FOLDER), name="static")
 
 @app.on_event("startup")
 async def startup():
-    await database.connect()
+    if RUN_DELIVERY_IN_APP:
+        delivery_workers.start()
+    if INBOX_MODE == "journal" and RUN_INBOX_IN_APP:
+        inbox_processors.start()
 
 
 @app.on_event("shutdown")
 async def shutdown():
-    await database.disconnect()
-
-
-def get_default_gpg_private_key_path():
-    default_gpg_path = os.path.join(config["main"]["data_folder"], "default_gpg_key")
-    private_default_gpg_path = os.path.join(default_gpg_path, "id_rsa")
-    return private_default_gpg_path
-
-def get_default_gpg():
-    default_gpg_path = os.path.join(config["main"]["data_folder"], "default_gpg_key")
-    private_default_gpg_path = os.path.join(default_gpg_path, "id_rsa")
-    public_default_gpg_path = os.path.join(default_gpg_path, "id_rsa.pub")
-    if not os.path.isfile(private_default_gpg_path):
-        print("No default gpg key, creating one")
-        generate_keys(default_gpg_path)
-    return_value = None
-    with open(public_default_gpg_path, encoding="utf-8") as f:
-        return_value = f.read()
-    return return_value
+    await delivery_workers.stop()
+    inbox_processors.stop()
+    verify_pool.close()
+    await async_engine.dispose()
+    http_client.close()
+
 
 @app.head("/noui")
 @app.get("/noui")
@@ -142,12 +139,66 @@ async def instance(request: Request):
     # TODO implement
     return [SERVER_URL]
 
-def get_context():
-    return ["https://www.w3.org/ns/activitystreams",
-    SERVER_URL + "/static/schemas/litepub-0.1.jsonld",
-    {
-        "@language":"und"
-    }]
+# Depth of the inbox journal and the delivery queue, for monitoring
+@app.get("/api/v1/fedigroup/queues")
+def queues(request: Request, db: Session = Depends(get_db)):
+    return {
+        "inbox": get_inbox_queue_depth(db),
+        "deliveries": get_pending_deliveries_count(db),
+    }
+
+def boost_to_api(boost) -> dict:
+    return {
+        "id": boost.note_id,
+        "group": boost.group.name,
+        "original_poster": boost.original_poster.name if boost.original_poster is not None else None,
+        "summary": boost.summary,
+        "content": boost.content,
+        "published": datetime_str(boost.original_time),
+    }
+
+def timeline_page(boosts, limit: int) -> dict:
+    next_cursor = None
+    if len(boosts) > 0 and len(boosts) == min(limit, PAGE_SIZE):
+        next_cursor = encode_cursor(boosts[-1].created_at, boosts[-1].id)
+    return {"items": [boost_to_api(boost) for boost in boosts], "next_cursor": next_cursor}
+
+def parse_cursor(cursor: Optional[str]):
+    if cursor is None:
+        return None
+    try:
+        return decode_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Search the posts of the groups the logged in member belongs to, a plain def so the
+# sync queries and the actor lookup run in the threadpool instead of on the event loop
+@app.get("/api/v1/fedigroup/search")
+def search(request: Request, q: str, limit: int = Query(MAX_SEARCH_RESULTS, ge=1, le=MAX_SEARCH_RESULTS),
+           offset: int = Query(0, ge=0),
+           db: Session = Depends(get_db), Authorize: AuthJWT = Depends()):
+    Authorize.jwt_required()
+    username = Authorize.get_jwt_subject()
+    results = []
+    for boost, rank in search_posts_for_member(db, username, q, limit, offset):
+        result = boost_to_api(boost)
+        result["rank"] = rank
+        results.append(result)
+    return results
+
+# Pages of the timelines, pass next_cursor of a page as cursor to get the one after it.
+# Plain defs so the sync queries run in the threadpool
+@app.get("/api/v1/fedigroup/timelines/home")
+def home_timeline(request: Request, cursor: Optional[str] = None, limit: int = Query(PAGE_SIZE, ge=1, le=PAGE_SIZE),
+                  db: Session = Depends(get_db), Authorize: AuthJWT = Depends()):
+    Authorize.jwt_required()
+    username = Authorize.get_jwt_subject()
+    return timeline_page(get_posts_for_member(db, username, parse_cursor(cursor), limit), limit)
+
+@app.get("/api/v1/fedigroup/timelines/public")
+def public_timeline(request: Request, cursor: Optional[str] = None, limit: int = Query(PAGE_SIZE, ge=1, le=PAGE_SIZE),
+                    db: Session = Depends(get_db)):
+    return timeline_page(get_posts_public(db, None, parse_cursor(cursor), limit), limit)
 
 # @app.head("/group/{id}/inbox")
 # @app.get("/group/{id}/inbox")
@@ -166,72 +217,23 @@ def get_context():
 
 # Example response: curl https://hayu.sh/users/guysoft  -H "Accept: application/activity+json"
 @app.get("/group/{id}")
-async def group_page(request: Request, id: str, db: Session = Depends(get_db)):
-    db_group = get_group_by_name(db, name=id)
+async def group_page(request: Request, id: str, db: AsyncSession = Depends(get_async_db)):
+    db_group = await get_group_by_name_async(db, name=id)
     if db_group is None:
         return {"error": "Group not found"}
 
-    context = get_context()
-    id_return = SERVER_URL + "/group/" + id
-    context_type = "Person" # This is an equivelent of a "Persion"
-    following = SERVER_URL + "/group/" + id + "/following"
-    followers = SERVER_URL + "/group/" + id + "/followers"
-    inbox = SERVER_URL + "/group/" + id + "/inbox"
-    outbox = "None"
-    featured = SERVER_URL + "/group/" + id + "/featured"
-    # Note preferredUsername has to be the same as name
-    preferredUsername = db_group.display_name
-    manuallyApprovesFollowers = False
-    discoverable = db_group.discoverable
-    name = db_group.name
-    summary = db_group.description
-    
-    url = SERVER_URL + "/group/" + id
-    publicKey = {"id": SERVER_URL + "/group/" + id + "#main-key","owner": SERVER_URL + "/" + id,"publicKeyPem": get_default_gpg()}
-    tag = []
-    attachment = []
-    endpoints = {"oauthAuthorizationEndpoint":SERVER_URL + "/oauth/authorize","oauthRegistrationEndpoint": SERVER_URL + "/api/v1/apps","oauthTokenEndpoint": SERVER_URL + "/oauth/token","sharedInbox": SERVER_URL + "/inbox","uploadMedia": SERVER_URL +"/api/ap/upload_media"}
-
-    icon = {"type": "Image","url": f"{SERVER_URL}{db_group.profile_picture}"}
-    if db_group.profile_picture == "default":
-        icon = {"type": "Image","url": DEFAULT_ICON}
+    document = get_group_actor(db_group)
+    summary = document.data["summary"]
+    icon = document.data["icon"]
+    image = document.data["image"]
 
-    image = {"type": "Image","url": f"{SERVER_URL}{db_group.cover_photo}"}
-    if db_group.cover_photo == "default":
-        image = {"type": "Image","url": DEFAULT_ICON}
-
-    return_value = {
-        "@context": context,
-        "id": id_return,
-        "type": context_type,
-        "following": following,
-        "followers": followers,
-        "inbox": inbox,
-        "outbox": outbox,
-        "featured": featured,
-        "preferredUsername": id,
-        "name": name,
-        "summary": summary,
-        "url": url,
-        "publicKey": publicKey,
-        "tag": tag,
-        "attachment": attachment,
-        "endpoints": endpoints,
-        "icon": icon,
-        "image": image,
-        "manuallyApprovesFollowers": manuallyApprovesFollowers,
-        "discoverable": discoverable,
-    }
-    
-    # return_value = json.loads("""{"@context": ["https://www.w3.org/ns/activitystreams", "https://w3id.org/security/v1"], "id": "https://pleroma.gnethomelinux.com/group/""" + id + """", "inbox": "https://pleroma.gnethomelinux.com/inbox", "preferredUsername": \"""" + id + """", "publicKey": {"id": "https://pleroma.gnethomelinux.com/group/""" + id + """#main-key", "owner": "https://pleroma.gnethomelinux.com/group/""" + id +"""", "publicKeyPem": "BOOP"}, "type": "Person"}""")
-
-    response = Response(content=json.dumps(return_value), media_type="application/activity+json")
-    # Uncomment to debug
-    # return response
     accept = request.headers["accept"]
     print(accept)
     if "json" in accept:
-        return response
+        headers = {"ETag": document.etag, "Cache-Control": f"public, max-age={GROUP_ACTOR_MAX_AGE}", "Vary": "Accept"}
+        if etag_matches(request.headers.get("if-none-match"), document.etag):
+            return Response(status_code=304, headers=headers)
+        return Response(content=document.body, media_type="application/activity+json", headers=headers)
 
     data = f'''
     <html>
@@ -252,8 +254,10 @@ async def group_page(request: Request, id: str, db: Session = Depends(get_db)):
 # Example response: curl https://hayu.sh/objects/0c4acc5b-5320-470f-8f39-74f52419746d  -H "Accept: application/activity+json"
 # Mastodon example response: curl https://tooot.im/@guysoft/104417134724456390  -H "Accept: application/activity+json"
 @app.get("/note/{id}")
-async def note(request: Request, id: str, db: Session = Depends(get_db)):
-    db_note = get_note(db, note_id=id)
+async def note(request: Request, id: str, db: AsyncSession = Depends(get_async_db)):
+    db_note = None
+    if id.isdigit():
+        db_note = await get_note_async(db, note_id=int(id))
     if db_note is None:
         return {"error": "Status not found"}
 
@@ -266,7 +270,9 @@ async def note(request: Request, id: str, db: Session = Depends(get_db)):
     
     attachment = []
 
-    actor = get_actor_url(db_note.attributed.name)
+    actor = db_note.attributed.uri
+    if actor is None:
+        actor = await asyncio.to_thread(get_actor_url, db_note.attributed.name)
     note_content = db_note.content
     source = db_note.source
 
@@ -324,36 +330,15 @@ def handle_activity_html_response(request: Request, return_value, data: str):
 
 # Example response: curl https://kitch.win/users/guysoft/followers  -H "Accept: application/activity+json"
 @app.get("/group/{id}/followers")
-def group_members(request: Request, id: str, db: Session = Depends(get_db)):
-    db_group = get_group_by_name(db, name=id)
+async def group_members(request: Request, id: str, page: bool = False, after: Optional[int] = None,
+                        db: AsyncSession = Depends(get_async_db)):
+    db_group = await get_group_by_name_async(db, name=id)
     if db_group is None:
         return {"error": "Group not found"}
 
-    members = []
-    for member in get_members_list(db, id):
-        members.append(member.member.name)
-
-    
-    return_value = {
-  "@context": get_context(),
-  "first": {
-    # "id": SERVER_URL + "/group/" + id  +"/followers?page=1",
-    "id": SERVER_URL + "/group/" + id  +"/followers",
-    # "next": SERVER_URL + "/group/" + id  +"/followers?page=2",
-    "next": SERVER_URL + "/group/" + id  +"/followers",
-
-    "orderedItems": members,
-    "partOf": SERVER_URL + "/group/" + id  +"/followers",
-    "totalItems": len(members),
-    "type": "OrderedCollectionPage"
-  },
-  "id": SERVER_URL + "/group/" + id  +"/followers",
-  "totalItems": len(members),
-  "type": "OrderedCollection"
-}
-    
-    response = Response(content=json.dumps(return_value), media_type="application/activity+json")
-    return response
+    body = await render_followers(db, db_group, page, after)
+    return Response(content=body, media_type="application/activity+json",
+                    headers={"Cache-Control": f"public, max-age={FOLLOWERS_CACHE_TTL}"})
 
 # Example response: curl https://hayu.sh/users/guysoft/following  -H "Accept: application/activity+json"
 @app.get("/group/{id}/following")
@@ -417,12 +402,12 @@ async def read_groups(db: Session = Depends(get_db)):
 # Doc https://docs.joinmastodon.org/spec/webfinger/
 @app.head("/.well-known/webfinger")
 @app.get("/.well-known/webfinger")
-async def webfinger(resource: str, db: Session = Depends(get_db)):
+async def webfinger(resource: str, db: AsyncSession = Depends(get_async_db)):
     acc_data = resource.split(":")
     id = acc_data[1]
     id_data = acc_data[1].split("@")
     username = id_data[0]
-    db_group = get_group_by_name(db, name=username)
+    db_group = await get_group_by_name_async(db, name=username)
     if db_group is None:
         return {"error": "Group not found"}
 
@@ -477,11 +462,6 @@ def mastodon_node_info():
     response = Response(content=json.dumps(return_value), media_type="application/json; charset=utf-8")
     return response
 
-async def send_follow_accept(inbox, accept_activity, preshared_key_id):
-    response = send_signed(inbox, accept_activity, get_default_gpg_private_key_path(), preshared_key_id)
-    print(f"Got accept follow request: {response}")
-
-
 
 # Shared inbox old code
 async def shared_inbox(request: Request, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
@@ -547,177 +527,24 @@ async def inbox(request: Request, background_tasks: BackgroundTasks, db: Session
         print(message)
         print(headers)
         return message
-    
-    body = json.loads(body_bytes.decode())
-    # print(body)
-    actor = body["actor"]    
-
-    request_id = body.get("id", None)
-    request_type = body.get("type", None)
-    requesting_actor = body.get("actor", None)
-    object_str = body.get("object", None)
-
-    # object = json.loads(object_str)
-    object = object_str
-
-
-    debug = False
-    # Debug data
-    # print(request.path_params)
-    # print("headers:")
-    # print(headers)
-    # print(signature)
-    # print("a:")
-    # print(await request.form())
-    # data = [i async for i in request.stream()]
-    # print(data)
-    # print("object_str:")
-    # print(object_str)
-    # print(object)
-    # debug = True
-
-    # Follow request from actor
-    incoming_actor_profile = get_profile(actor)
-    if "publicKey" in incoming_actor_profile.keys():
-        pub_key = incoming_actor_profile["publicKey"]["publicKeyPem"]
-    else:
-        print("No key for actor")
-        print(incoming_actor_profile)
-        print(body)
-        return "No key for actor"
-    url = request.url._url
-    
-    
-    parsed = urlparse(url)
-    path = parsed.path
-    digest = headers["digest"]
-    
-    verify_result = verify_post_headers("", pub_key,
-                                dict(headers),
-                                path, False,
-                                digest,
-                                body_bytes.decode(), debug)
-
-    if verify_result:
-        print("Signiture is valid")
-
-        print("got type: " + str(request_type))
-            
-
-        if request_type == "Follow":
-            print("Got follow request")
-
-            # requesting_actor = object.get("actor", None)
-            inbox = get_actor_inbox(requesting_actor)            
-            preshared_key_id = get_group_path(group) + "#main-key"
-
-            # Add to follower collection
-            member_relation = {
-                "group": group,
-                "member": actor_to_address_format(requesting_actor)
-                }
-            result = add_member_to_group(db=db, item=member_relation)
-
-            accept_activity = {
-                '@context': 'https://www.w3.org/ns/activitystreams', 
-                'id': get_group_path(group) + '#accepts/follows/' + str(time.time()),
-                'type': 'Accept',
-                'actor': get_group_path(group),
-                'object': {
-                    'id': request_id,
-                    'type': 'Follow',
-                    'actor': requesting_actor,
-                    'object': get_group_path(group)
-                    }
-            }
-
-            if result is not None:
-                # Send back accept
-
-                # response = await send_signed(inbox, accept_activity, get_default_gpg_private_key_path(), preshared_key_id)
-                # print(response)
-                background_tasks.add_task(send_follow_accept, inbox, accept_activity, preshared_key_id)
-            else:
-                print("Error: got none reply for add_member_to_group")
-
-        elif request_type == "Accept":
-            print("Got accepted!")
-            print(object)
-            # send_signed()
-            # TODO: Add add following to db
-        elif request_type == "Undo":
-            print("Got unfollow request")
-            # Add to follower collection
-            member_relation = {
-                "group": group,
-                "member": actor_to_address_format(requesting_actor)
-                }
-            result = remove_member_grom_group(db=db, item=member_relation)
-            # background_tasks.add_task(send_follow_accept, inbox, accept_activity, preshared_key_id)
-        elif request_type == "Announce":
-            note_boosted = body["object"]
-            print("Got a boost to status: " + str(note_boosted))
-            #TODO handle boost addition to db
-
-            print(json.dumps(body))
-
-        elif request_type == "Create":
-            object_created = body.get("object", None)
-            object_created_type = object_created.get("type", None)
-            if object_created_type == "Note":
-                object_tos = object_created["to"]
-                object_ccs = object_created["cc"]
-                object_id = object_created["id"]
-
-                tags = object_created["tag"]
-
-                mentions = []
-
-                for tag in tags:
-                    tag_id = tag["href"]
-                    if tag["type"] == "Mention":
-                        local_actor = actor_to_address_format(tag_id)
-                        if local_actor is not None:
-                            if local_actor not in mentions:
-                                mentions.append(local_actor)
-
-                for recipient in object_tos + object_ccs:
-                    recipient_actor = actor_to_address_format(recipient)
-                
-                if recipient is not None:
-                    if recipient not in mentions:
-                        mentions.append(recipient)
-
-                local_mentions = []
-                for mention in mentions:
-                    if is_local_actor(mention):
-                        group = get_handle_name(mention)
-                        group_db = get_group_by_name(db, group)
-                        if group_db is not None:
-                            print("Got mention!")
-                            local_mentions.append(group)
-
-                if len(local_mentions) > 0:
-                    print("Add boost to db and handle mentions")
-                    boost_db = get_boost_by_note_id(db, note_id=object_id)
-                    if boost_db is None:
-                        print(f"processing: {object_id}")
-                        background_tasks.add_task(save_message_and_boost, db, object_created, local_mentions)
-                    else:
-                        print(f"Already got: {object_id}")
-                    return "ok"
-        elif request_type == "Delete":
-            print("Got delete request, unimplemented")
-
-
-        else:
-            print("Got unhandled request type: " + str(body))
-            print("request type: " + str(request_type))
-    else:
-        print("Signature was not valid")
-        return "Signature was not valid"
 
-    return
+    headers = dict(headers)
+    error = check_inbox_request(headers, body_bytes)
+    if error is not None:
+        print(f"Rejected inbox request: {error}")
+        raise HTTPException(status_code=400, detail=error)
+
+    path = urlparse(request.url._url).path
+    if INBOX_MODE == "journal":
+        async with AsyncSessionLocal() as async_db:
+            if await is_activity_seen_async(async_db, json.loads(body_bytes.decode()).get("id", None)):
+                return Response(status_code=202)
+            # Verified and handled by the inbox processors
+            await journal_inbox_request_async(async_db, path, headers, body_bytes, group)
+        return Response(status_code=202)
+
+    # Handled right here
+    return await handle_inbox_activity(db, background_tasks, path, headers, body_bytes, group)
 
 @app.post('/oauth_login_submit')
 async def oauth_login_submit(request: Request, form: GroupCreateForm = Depends(OauthLogin.as_form), db: Session = Depends(get_db)):
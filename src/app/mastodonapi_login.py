@@ -4,7 +4,7 @@ from app.mastodonapi import get_oauth_url, d2url, REDIERCT_URI_BACKEND, REDIERCT
 from mastodon import Mastodon
 from mastodon.errors import MastodonUnauthorizedError
 from sqlmodel import Session
-import requests
+from app import http_client
 
 debug = False
 
@@ -47,9 +47,6 @@ def get_access_token(db, domain, client_id, client_secret, scopes, code, state,
             'Authorization': f'Bearer {code}'
         }
 
-        s = requests.Session()
-        s.headers.update(headers)
-
         data = {'code':  code,
         'redirect_uri': REDIERCT_URI_FRONTEND,
         'grant_type': 'authorization_code',
@@ -58,7 +55,7 @@ def get_access_token(db, domain, client_id, client_secret, scopes, code, state,
         'scope': 'read'
         }
 
-        r = s.post(f"{url}/oauth/token", data=data)
+        r = http_client.post(f"{url}/oauth/token", data=data, headers=headers)
         response_data = r.json()
 
         access_token = response_data["access_token"]
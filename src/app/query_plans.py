@@ -0,0 +1,190 @@
+"""Query plan checks for the hot lookups in crud
+
+Seeds a large synthetic dataset inside a transaction, runs the hot crud functions
+against it, and EXPLAINs every statement they send. A sequential scan on one of the
+big tables means an index is missing or not used. Everything is rolled back at the
+end, the check can run against a live database.
+
+Run with: fgctl check-query-plans
+"""
+import json
+from typing import Any, Callable, Dict, List, Tuple
+
+from sqlalchemy import event, text
+from sqlmodel import Session
+
+from app.crud import get_boost_by_note_id, get_actor_or_create, get_actor_by_uri, member_in_group, \
+get_group_delivery_inboxes, get_members_needing_endpoints, get_posts_for_member, get_posts_public, get_threads
+from app.db import Boost, Note, engine
+
+# Tables big enough that a sequential scan on them is a regression
+GUARDED_TABLES = {"actors", "boosts", "boosts_recipients", "groups_members", "home_timeline", "notes_recipients"}
+
+SEED_DOMAIN = "seed.invalid"
+
+SEED_STATEMENTS = [
+    """INSERT INTO actors (name, profile_picture, uri)
+    SELECT 'user' || i || '@{domain}', 'default', 'https://{domain}/users/' || i
+    FROM generate_series(1, :actors) i""",
+
+    """INSERT INTO groups (display_name, name, description, profile_picture, cover_photo, discoverable, creator_id)
+    SELECT 'Seed group ' || i, 'seedgroup' || i, '', 'default', 'default', true,
+        (SELECT min(id) FROM actors WHERE name LIKE '%@{domain}')
+    FROM generate_series(1, :groups) i""",
+
+    # Every actor joins three groups
+    """INSERT INTO groups_members (group_id, member_id, created_at, actor_url, inbox, shared_inbox)
+    SELECT g.first_id + ((a.n * 7 + k * 13) % :groups), a.id, now(), a.uri, a.uri || '/inbox',
+        'https://' || (a.n % 500) || '.{domain}/inbox'
+    FROM (SELECT id, uri, row_number() OVER (ORDER BY id) n FROM actors WHERE name LIKE '%@{domain}') a,
+        generate_series(0, 2) k,
+        (SELECT min(id) first_id FROM groups WHERE name LIKE 'seedgroup%') g""",
+
+    """INSERT INTO boosts (group_id, attributed_id, original_poster_id, content, note_id, original_time, created_at,
+        sensitive)
+    SELECT g.first_id + (i % :groups), a.first_id, a.first_id + (i % :actors), 'seed',
+        'https://{domain}/notes/' || i, now() - i * interval '1 second', now() - i * interval '1 second',
+        false
+    FROM generate_series(1, :boosts) i,
+        (SELECT min(id) first_id FROM groups WHERE name LIKE 'seedgroup%') g,
+        (SELECT min(id) first_id FROM actors WHERE name LIKE '%@{domain}') a""",
+
+    # One in five boosts is a reply to the boost before it
+    """UPDATE boosts SET in_reply_to_id = id - 1
+    WHERE note_id LIKE 'https://{domain}/notes/%' AND id % 5 = 0""",
+
+    # Timelines of one member in a hundred, enough rows for the planner to prefer the index
+    """INSERT INTO home_timeline (member_id, boost_id, group_id, created_at)
+    SELECT m.member_id, b.id, b.group_id, b.created_at
+    FROM boosts b JOIN groups_members m ON m.group_id = b.group_id
+    JOIN actors a ON a.id = m.member_id
+    WHERE b.in_reply_to_id IS NULL AND b.note_id LIKE 'https://{domain}/notes/%'
+        AND a.name LIKE '%@{domain}' AND a.id % 100 = 0""",
+
+    """INSERT INTO boosts_recipients (boost_id, url, type)
+    SELECT id, 'https://{domain}/followers', 'to'::recipienttype
+    FROM boosts WHERE note_id LIKE 'https://{domain}/notes/%'""",
+
+    """INSERT INTO notes (group_id, attributed_id, content, source, created_at, replies_count, sensitive, attachment)
+    SELECT g.first_id + (i % :groups), a.first_id + (i % :actors), 'seed', '', now(), 0, false, '[]'
+    FROM generate_series(1, :notes) i,
+        (SELECT min(id) first_id FROM groups WHERE name LIKE 'seedgroup%') g,
+        (SELECT min(id) first_id FROM actors WHERE name LIKE '%@{domain}') a""",
+
+    """INSERT INTO notes_recipients (note_id, url, type)
+    SELECT n.id, 'https://{domain}/followers', 'to'::recipienttype
+    FROM notes n WHERE n.content = 'seed'""",
+]
+
+
+def seed(db: Session, actors: int, groups: int, boosts: int, notes: int) -> Dict[str, Any]:
+    """Insert the synthetic dataset and return values to look up in it"""
+    parameters = {"actors": actors, "groups": groups, "boosts": boosts, "notes": notes}
+    for statement in SEED_STATEMENTS:
+        db.execute(text(statement.format(domain=SEED_DOMAIN)), parameters)
+    for table in GUARDED_TABLES | {"groups", "notes"}:
+        db.execute(text(f"ANALYZE {table}"))
+
+    # A member with a seeded home timeline
+    actor_name, actor_uri = db.execute(text("SELECT name, uri FROM actors WHERE name LIKE :pattern AND id % 100 = 0 "
+                                            "LIMIT 1"), {"pattern": f"%@{SEED_DOMAIN}"}).one()
+    values = {
+        "actor_name": actor_name,
+        "actor_uri": actor_uri,
+        "group_name": f"seedgroup{groups // 2}",
+        "note_id": f"https://{SEED_DOMAIN}/notes/{boosts // 2}",
+    }
+    values["group_id"] = db.execute(text("SELECT id FROM groups WHERE name = :name"),
+                                    {"name": values["group_name"]}).scalar()
+    values["boost_id"] = db.execute(text("SELECT in_reply_to_id FROM boosts WHERE in_reply_to_id IS NOT NULL "
+                                         "AND note_id LIKE :pattern LIMIT 1"),
+                                    {"pattern": f"https://{SEED_DOMAIN}/notes/%"}).scalar()
+    values["note_row_id"] = db.execute(text("SELECT max(id) FROM notes WHERE content = 'seed'")).scalar()
+    return values
+
+
+def _comments(db: Session, values: Dict[str, Any]):
+    return db.get(Boost, values["boost_id"]).comments
+
+
+def _boost_recipients(db: Session, values: Dict[str, Any]):
+    return db.get(Boost, values["boost_id"]).recipients
+
+
+def _note_recipients(db: Session, values: Dict[str, Any]):
+    return db.get(Note, values["note_row_id"]).recipients
+
+
+def _member_in_group(db: Session, values: Dict[str, Any]):
+    actor = get_actor_or_create(db, values["actor_name"])
+    return member_in_group(db, values["group_name"], actor)
+
+
+HOT_QUERIES: List[Tuple[str, Callable[[Session, Dict[str, Any]], Any]]] = [
+    ("get_boost_by_note_id", lambda db, values: get_boost_by_note_id(db, values["note_id"])),
+    ("get_actor_or_create", lambda db, values: get_actor_or_create(db, values["actor_name"])),
+    ("get_actor_by_uri", lambda db, values: get_actor_by_uri(db, values["actor_uri"])),
+    ("member_in_group", _member_in_group),
+    ("get_group_delivery_inboxes", lambda db, values: get_group_delivery_inboxes(db, values["group_id"])),
+    ("get_members_needing_endpoints", lambda db, values: get_members_needing_endpoints(db, values["group_id"])),
+    ("get_posts_for_member", lambda db, values: get_posts_for_member(db, values["actor_name"])),
+    ("get_posts_public", lambda db, values: get_posts_public(db, values["actor_name"])),
+    ("get_threads", lambda db, values: get_threads(db, [values["boost_id"]])),
+    ("Boost.comments", _comments),
+    ("Boost.recipients", _boost_recipients),
+    ("Note.recipients", _note_recipients),
+]
+
+
+def sequential_scans(plan: Dict[str, Any]) -> List[str]:
+    """Guarded tables read with a sequential scan anywhere in a plan"""
+    found = []
+    if plan.get("Node Type") == "Seq Scan" and plan.get("Relation Name") in GUARDED_TABLES:
+        found.append(plan["Relation Name"])
+    for child in plan.get("Plans", []):
+        found += sequential_scans(child)
+    return found
+
+
+def check_query_plans(actors: int = 20000, groups: int = 200, boosts: int = 100000,
+                      notes: int = 10000) -> List[str]:
+    """Seed, run the hot queries and EXPLAIN them, everything is rolled back
+
+    Returns:
+        List[str]: One message per query that scanned a guarded table sequentially, empty if all is well
+    """
+    connection = engine.connect()
+    transaction = connection.begin()
+    db = Session(bind=connection)
+    failures = []
+    try:
+        values = seed(db, actors, groups, boosts, notes)
+
+        for name, run_query in HOT_QUERIES:
+            captured = []
+
+            def capture(conn, cursor, statement, parameters, context, executemany):
+                if statement.lstrip().upper().startswith("SELECT"):
+                    captured.append((statement, parameters))
+
+            # Start from an empty identity map so lazy loads really query
+            db.expunge_all()
+            event.listen(connection, "before_cursor_execute", capture)
+            try:
+                run_query(db, values)
+            finally:
+                event.remove(connection, "before_cursor_execute", capture)
+
+            for statement, parameters in captured:
+                plan = connection.exec_driver_sql("EXPLAIN (FORMAT JSON) " + statement, parameters).scalar()
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                scans = sequential_scans(plan[0]["Plan"])
+                if len(scans) > 0:
+                    failures.append(f"{name}: sequential scan on {', '.join(sorted(set(scans)))}\n{statement}")
+                print(f"{name}: {'seq scan on ' + ', '.join(scans) if scans else 'ok'}")
+    finally:
+        db.close()
+        transaction.rollback()
+        connection.close()
+    return failures
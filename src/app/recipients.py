@@ -0,0 +1,112 @@
+"""Classify the to/cc urls of a note as actors or collections
+
+Most recipients are followers collections or the public collection, these are told
+apart from actors by their url without going to the network. Remote urls we had to
+look at are remembered, and actors we store are found by their uri. Whatever is left
+is fetched concurrently, so a note with many addressees is not a chain of round trips.
+"""
+import asyncio
+from typing import Dict, Iterable, List, Optional
+
+from sqlmodel import select
+
+from app import http_client
+from app.cache import TTLCache
+from app.common import get_config, SERVER_URL
+from app.db import Actor, SessionLocal
+from app.get_federated_data import get_profile_async
+
+config = get_config()
+CACHE_CONFIG = config.get("cache", None) or {}
+
+RECIPIENT_TTL = CACHE_CONFIG.get("recipient_ttl", 86400)
+RECIPIENT_MEMORY_SIZE = CACHE_CONFIG.get("recipient_memory_size", 10000)
+RECIPIENT_CONCURRENCY = CACHE_CONFIG.get("recipient_concurrency", 20)
+
+ACTOR = "actor"
+COLLECTION = "collection"
+PUBLIC = "public"
+# Could not be fetched, stored like a collection: a url without an actor
+UNKNOWN = "unknown"
+
+COLLECTION_SUFFIXES = ("/followers", "/following")
+
+_kinds = TTLCache(RECIPIENT_MEMORY_SIZE, RECIPIENT_TTL)
+
+
+def classify_without_network(url: str) -> Optional[str]:
+    """Returns the kind of a recipient url if it can be told from the url alone"""
+    if "https://www.w3.org/ns/activitystreams" in url or url in ("as:Public", "Public"):
+        return PUBLIC
+    if url.rstrip("/").endswith(COLLECTION_SUFFIXES):
+        return COLLECTION
+    if url.startswith(SERVER_URL + "/group/"):
+        return ACTOR
+    return None
+
+
+def kind_from_profile(profile) -> str:
+    if not isinstance(profile, dict) or "type" not in profile:
+        return UNKNOWN
+    profile_type = profile["type"]
+    if isinstance(profile_type, list):
+        profile_type = " ".join(str(item) for item in profile_type)
+    if "Collection" in str(profile_type):
+        return COLLECTION
+    return ACTOR
+
+
+async def _fetch_kinds(urls: List[str]) -> Dict[str, str]:
+    semaphore = asyncio.Semaphore(RECIPIENT_CONCURRENCY)
+
+    async def fetch_kind(url: str) -> str:
+        async with semaphore:
+            try:
+                return kind_from_profile(await get_profile_async(url))
+            except Exception as e:
+                print(f"Error: could not classify recipient {url}: {e}")
+                return UNKNOWN
+
+    kinds = await asyncio.gather(*[fetch_kind(url) for url in urls])
+    return dict(zip(urls, kinds))
+
+
+def classify_recipients(urls: Iterable[str]) -> Dict[str, str]:
+    """Classify many recipient urls at once
+
+    Args:
+        urls (Iterable[str]): The to and cc urls of a note
+
+    Returns:
+        Dict[str, str]: The kind of each url, one of ACTOR, COLLECTION, PUBLIC or UNKNOWN
+    """
+    result = {}
+    missing = []
+    for url in dict.fromkeys(urls):
+        kind = classify_without_network(url)
+        if kind is None:
+            kind = _kinds.get(url)
+        if kind is not None:
+            result[url] = kind
+        else:
+            missing.append(url)
+
+    if len(missing) > 0:
+        db = SessionLocal()
+        try:
+            known = set(db.exec(select(Actor.uri).where(Actor.uri.in_(missing))).all())
+        finally:
+            db.close()
+        for url in known:
+            result[url] = ACTOR
+            _kinds.set(url, ACTOR)
+        missing = [url for url in missing if url not in known]
+
+    if len(missing) > 0:
+        fetched = http_client.run(_fetch_kinds(missing))
+        for url, kind in fetched.items():
+            result[url] = kind
+            # Failures are not remembered, the server might be back next time
+            if kind != UNKNOWN:
+                _kinds.set(url, kind)
+    return result
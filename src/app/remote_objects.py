@@ -0,0 +1,144 @@
+"""Shared store of fetched ActivityPub objects
+
+Every remote object we read (notes and the ancestors of replies) is kept once in the
+remote_objects table, keyed by its id, with its ETag and a hash of its content. The
+JSON is stored as JSONB, which Postgres compresses when it is large. Boosts of the
+same note in several groups reference one row instead of each holding a copy.
+
+Reads go through an in-process LRU, then the table, and only when the stored copy is
+stale through a conditional GET.
+"""
+import asyncio
+import hashlib
+import json
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+import httpx
+from sqlalchemy import update
+from sqlalchemy.dialects.postgresql import insert
+
+from app import http_client
+from app.cache import TTLCache
+from app.common import get_config
+from app.db import RemoteObject, SessionLocal
+
+config = get_config()
+CACHE_CONFIG = config.get("cache", None) or {}
+
+OBJECT_TTL = CACHE_CONFIG.get("object_ttl", 3600)
+OBJECT_MEMORY_SIZE = CACHE_CONFIG.get("object_memory_size", 2000)
+
+ACTIVITY_JSON_HEADERS = {
+    'Accept': 'application/activity+json',
+}
+
+_memory = TTLCache(OBJECT_MEMORY_SIZE, OBJECT_TTL)
+
+
+def content_hash(data: Dict[str, Any]) -> str:
+    return hashlib.sha256(json.dumps(data, sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+
+def _remaining_ttl(fetched_at: datetime) -> float:
+    return OBJECT_TTL - (datetime.utcnow() - fetched_at).total_seconds()
+
+
+def _store(db, url: str, data: Dict[str, Any], etag: Optional[str], last_modified: Optional[str]) -> None:
+    now = datetime.utcnow()
+    values = {
+        "id": url,
+        "data": data,
+        "content_hash": content_hash(data),
+        "fetched_at": now,
+        "etag": etag,
+        "last_modified": last_modified,
+    }
+    # An unchanged object is not rewritten, only its fetch time and validators are
+    statement = insert(RemoteObject).values(**values).on_conflict_do_update(
+        index_elements=[RemoteObject.id],
+        set_={key: value for key, value in values.items() if key != "id"},
+        where=RemoteObject.content_hash != values["content_hash"],
+    )
+    if db.execute(statement).rowcount == 0:
+        db.execute(update(RemoteObject).where(RemoteObject.id == url)
+                   .values(fetched_at=now, etag=etag, last_modified=last_modified))
+    db.commit()
+
+
+def get_object(url: str, refresh: bool = False, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+    """Returns the object with the given id, going to the network only when the stored copy is stale
+
+    Args:
+        url (str): The object id
+        refresh (bool): Revalidate with the remote server even if the stored copy is fresh
+        timeout (Optional[float]): Seconds allowed for the request, the client default if not given
+
+    Returns:
+        Optional[Dict[str, Any]]: The object, None if it could not be fetched
+    """
+    if not refresh:
+        data = _memory.get(url)
+        if data is not None:
+            return data
+
+    db = SessionLocal()
+    try:
+        row = db.get(RemoteObject, url)
+        if row is not None and not refresh and _remaining_ttl(row.fetched_at) > 0:
+            _memory.set(url, row.data, _remaining_ttl(row.fetched_at))
+            return row.data
+
+        headers = dict(ACTIVITY_JSON_HEADERS)
+        if row is not None:
+            if row.etag is not None:
+                headers["If-None-Match"] = row.etag
+            if row.last_modified is not None:
+                headers["If-Modified-Since"] = row.last_modified
+
+        kwargs = {}
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+        try:
+            r = http_client.get(url, headers=headers, **kwargs)
+        except httpx.HTTPError as e:
+            print(f"Error: failed to fetch {url}: {e}")
+            return row.data if row is not None else None
+
+        if r.status_code == 304 and row is not None:
+            row.fetched_at = datetime.utcnow()
+            db.commit()
+            _memory.set(url, row.data)
+            return row.data
+
+        if r.status_code >= 400:
+            print(f"Error: got {r.status_code} for {url}")
+            return None
+
+        try:
+            data = r.json()
+        except ValueError:
+            print("Error, failed to decode: " + str(url))
+            return None
+        if not isinstance(data, dict):
+            return None
+
+        _store(db, url, data, r.headers.get("etag"), r.headers.get("last-modified"))
+        _memory.set(url, data)
+        return data
+    finally:
+        db.close()
+
+
+async def get_object_async(url: str, refresh: bool = False) -> Optional[Dict[str, Any]]:
+    """Same as get_object, answers fresh entries from memory without leaving the event loop"""
+    if not refresh:
+        data = _memory.get(url)
+        if data is not None:
+            return data
+    return await asyncio.to_thread(get_object, url, refresh)
+
+
+def is_cached(url: str) -> bool:
+    """True if the object can be read without the network"""
+    return url in _memory
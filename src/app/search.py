@@ -0,0 +1,48 @@
+"""Full text search over the boosts of a member's groups
+
+Boosts carry a generated tsvector of their summary and content with the html stripped,
+backed by a GIN index, so a search is an index lookup and a ranking of the matches
+instead of a LIKE scan over every post.
+"""
+from typing import List, Tuple
+
+from sqlalchemy import func
+from sqlmodel import Session
+
+from app.common import get_config
+from app.crud import get_actor_or_create, select_boosts_of_member
+from app.db import Boost, SEARCH_TEXT_CONFIG
+
+config = get_config()
+SEARCH_CONFIG = config.get("search", None) or {}
+
+MAX_RESULTS = SEARCH_CONFIG.get("max_results", 50)
+
+
+def search_posts_for_member(db: Session, actor_handle: str, query: str, limit: int = MAX_RESULTS,
+                            offset: int = 0) -> List[Tuple[Boost, float]]:
+    """Search the boosts of the groups a member belongs to
+
+    Args:
+        db (Session): the db session
+        actor_handle (str): The member, in the user@server format
+        query (str): Search words, quoted phrases, OR and -excluded words are understood
+        limit (int): Results to return, at most max_results
+        offset (int): Results to skip, for paging
+
+    Returns:
+        List[Tuple[Boost, float]]: Matching boosts and their rank, best match first
+    """
+    query = query.strip()
+    if len(query) == 0:
+        return []
+
+    actor = get_actor_or_create(db, actor_handle)
+    ts_query = func.websearch_to_tsquery(SEARCH_TEXT_CONFIG, query)
+    rank = func.ts_rank_cd(Boost.search_vector, ts_query).label("rank")
+    statement = (select_boosts_of_member(actor, rank)
+                 .where(Boost.search_vector.op("@@")(ts_query))
+                 .order_by(rank.desc(), Boost.created_at.desc())
+                 .offset(offset)
+                 .limit(min(limit, MAX_RESULTS)))
+    return [(boost, rank) for boost, rank in db.exec(statement).all()]
@@ -0,0 +1,109 @@
+"""Dedupe of incoming activities by their id
+
+Remote servers retry deliveries and relays or several mentions can bring the same
+activity more than once. Ids are remembered in a bounded in-process cache and in the
+seen_activities table until they expire, so a duplicate is answered before any
+network fetch or signature check.
+
+An id is only claimed after the signature was verified, so unsigned requests can not
+burn the id of a real activity.
+"""
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import delete
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import select, Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.cache import TTLCache
+from app.common import get_config
+from app.db import SeenActivity
+
+config = get_config()
+CACHE_CONFIG = config.get("cache", None) or {}
+
+SEEN_ACTIVITY_TTL = CACHE_CONFIG.get("seen_activity_ttl", 604800)
+SEEN_ACTIVITY_MEMORY_SIZE = CACHE_CONFIG.get("seen_activity_memory_size", 20000)
+
+_memory = TTLCache(SEEN_ACTIVITY_MEMORY_SIZE, SEEN_ACTIVITY_TTL)
+
+
+def is_activity_seen(db: Session, activity_id: Optional[str]) -> bool:
+    """Returns True if the activity was already taken in, activities with no id never are"""
+    if activity_id is None:
+        return False
+    if activity_id in _memory:
+        return True
+
+    row = db.exec(select(SeenActivity)
+                  .where(SeenActivity.activity_id == activity_id)
+                  .where(SeenActivity.expires_at > datetime.utcnow())).first()
+    if row is None:
+        return False
+    _memory.set(activity_id, True, (row.expires_at - datetime.utcnow()).total_seconds())
+    return True
+
+
+async def is_activity_seen_async(db: AsyncSession, activity_id: Optional[str]) -> bool:
+    """Same as is_activity_seen, on an async session"""
+    if activity_id is None:
+        return False
+    if activity_id in _memory:
+        return True
+
+    row = (await db.exec(select(SeenActivity)
+                         .where(SeenActivity.activity_id == activity_id)
+                         .where(SeenActivity.expires_at > datetime.utcnow()))).first()
+    if row is None:
+        return False
+    _memory.set(activity_id, True, (row.expires_at - datetime.utcnow()).total_seconds())
+    return True
+
+
+def claim_activity(db: Session, activity_id: Optional[str]) -> bool:
+    """Marks an activity as seen
+
+    Args:
+        db (Session): the db session
+        activity_id (Optional[str]): The id of the activity
+
+    Returns:
+        bool: True if we are the first to take it in and should handle it, False if it is a duplicate
+    """
+    if activity_id is None:
+        return True
+    if activity_id in _memory:
+        return False
+
+    now = datetime.utcnow()
+    values = {"activity_id": activity_id, "seen_at": now, "expires_at": now + timedelta(seconds=SEEN_ACTIVITY_TTL)}
+    statement = insert(SeenActivity).values(**values)
+    # An expired id can be claimed again, a live one is left alone
+    statement = statement.on_conflict_do_update(
+        index_elements=[SeenActivity.activity_id],
+        set_={"seen_at": statement.excluded.seen_at, "expires_at": statement.excluded.expires_at},
+        where=SeenActivity.expires_at <= now,
+    ).returning(SeenActivity.activity_id)
+    claimed = db.execute(statement).first() is not None
+    db.commit()
+
+    _memory.set(activity_id, True)
+    return claimed
+
+
+def forget_activity(db: Session, activity_id: Optional[str]) -> None:
+    """Drops a claim, used when handling failed so a retried delivery is handled again"""
+    if activity_id is None:
+        return
+    _memory.pop(activity_id)
+    db.rollback()
+    db.execute(delete(SeenActivity).where(SeenActivity.activity_id == activity_id))
+    db.commit()
+
+
+def purge_expired_activities(db: Session) -> int:
+    """Deletes expired ids, returns how many were removed"""
+    result = db.execute(delete(SeenActivity).where(SeenActivity.expires_at <= datetime.utcnow()))
+    db.commit()
+    return result.rowcount
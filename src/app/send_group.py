@@ -1,6 +1,7 @@
 # functions that use both crud and send federated data
-from typing import Any, Dict, List
-from datetime import datetime, timezone
+import asyncio
+from typing import Any, Dict, List, Optional
+from datetime import datetime, timedelta, timezone
 from sqlalchemy.orm import Session
 from urllib.parse import urljoin
 from app.crud import (
@@ -9,15 +10,32 @@ from app.crud import (
     create_activity_to_send_from_note,
     create_activity_to_send_from_boost,
     get_members_list, get_group_by_name,
-    get_actor_or_create, create_boost,
+    get_actor_or_create, create_boost, create_boosts,
     create_federated_note,
     member_in_group,
-    get_boost_by_note_id
+    get_boost_by_note_id,
+    get_group_delivery_inboxes,
+    get_members_needing_endpoints,
+    update_member_endpoints,
+    mark_member_endpoints_failed
 )
-from app.common import SERVER_DOMAIN, SERVER_URL, multi_urljoin, is_local_actor, get_handle_name, get_server_keys
-from app.send_federated_data import send_signed
-from app.get_federated_data import actor_to_address_format, get_actor_inbox, get_actor_url
+from app.common import SERVER_DOMAIN, SERVER_URL, multi_urljoin, is_local_actor, get_handle_name, get_server_keys, \
+get_config
+from app.delivery_queue import enqueue_delivery
+from app.get_federated_data import actor_to_address_format, get_profile_async, inbox_from_profile, \
+shared_inbox_from_profile
+from app.webfinger_cache import resolve_many
 from app.schemas import NoteCreate
+from app import http_client
+import httpx
+
+config = get_config()
+CACHE_CONFIG = config.get("cache", None) or {}
+
+# How long the inboxes stored on a membership are trusted before being refreshed
+MEMBER_ENDPOINTS_TTL = CACHE_CONFIG.get("member_endpoints_ttl", 7 * 86400)
+# Member profiles fetched at once when refreshing inboxes
+MEMBER_ENDPOINTS_CONCURRENCY = CACHE_CONFIG.get("member_endpoints_concurrency", 20)
 
 def fedigroup_message(db: Session, group: str, message: str, preshared_key_id, key_path) -> Dict[str, Any]:
     """Send a group message to all members in group"""
@@ -76,12 +94,14 @@ def save_message_and_boost(db: Session, item: Dict[str, Any], groups: List[str])
 
     print(f"note_id: {note_id}")
 
+    in_reply_to = item.get("inReplyTo", None)
+    replied_to_existing_topic = in_reply_to is not None and get_boost_by_note_id(db, in_reply_to) is not None
+
+    boost_data_dicts = []
     for group in groups:
         print(f"boosting test group: {group}")
         actor = group + "@" + SERVER_DOMAIN
         group_db = get_group_by_name(db, group)
-        in_reply_to = item.get("inReplyTo", None)
-        replied_to_existing_topic = in_reply_to is not None and get_boost_by_note_id(db, in_reply_to) is not None
         is_member_in_group = member_in_group(db, group, author_of_note)
 
         if is_member_in_group or replied_to_existing_topic:
@@ -99,13 +119,17 @@ def save_message_and_boost(db: Session, item: Dict[str, Any], groups: List[str])
                 ],
                 "cc": []
                 }
-            
-            boost = create_boost(db, boost_data_dict)
-            activity = create_activity_to_send_from_boost(boost)
-            preshared_key_id, key_path = get_server_keys(group)
-            send_message(db, activity, preshared_key_id, key_path, activity["to"])
+            boost_data_dicts.append(boost_data_dict)
         else:
             print(f"Author or note {author_of_note.name} is not a member of group {group}, not boosting")
+
+    # The note is fetched once and all the boosts stored together, then each group sends its own
+    group_names = [boost_data_dict["group"].name for boost_data_dict in boost_data_dicts]
+    boosts = create_boosts(db, boost_data_dicts)
+    for group, boost in zip(group_names, boosts):
+        activity = create_activity_to_send_from_boost(boost)
+        preshared_key_id, key_path = get_server_keys(group)
+        send_message(db, activity, preshared_key_id, key_path, activity["to"])
     return
 
 
@@ -122,22 +146,76 @@ def send_message(db, activity, preshared_key_id, key_path, recipients):
             db_group = get_group_by_name(db, group)
             
             if db_group is not None:
-                members = db_group.members
-            
-                for member in members:
-                    try:
-                        actor_inbox = get_actor_inbox(get_actor_url(member.member.name), shared=True)
-                        if actor_inbox not in inboxes:
-                            inboxes.append(actor_inbox)
-                    except AttributeError:
-                        print(f"ERROR: could not message to member: {member.member.name}")
-
-    send_signed_multi(activity, inboxes, preshared_key_id, key_path)
+                # Members that followed before inboxes were stored, failures wait for the stale refresh
+                refresh_member_endpoints(db, get_members_needing_endpoints(db, db_group.id))
+
+                for actor_inbox in get_group_delivery_inboxes(db, db_group.id):
+                    if actor_inbox not in inboxes:
+                        inboxes.append(actor_inbox)
+
+    # Stale inboxes are refreshed by fgctl refresh-stale-member-inboxes, not while sending
+    send_signed_multi(db, activity, inboxes, preshared_key_id, key_path)
+
+
+async def _fetch_profiles_async(actor_urls: List[str]) -> List[Optional[Dict[str, Any]]]:
+    semaphore = asyncio.Semaphore(MEMBER_ENDPOINTS_CONCURRENCY)
+
+    async def fetch(actor_url):
+        async with semaphore:
+            try:
+                return await get_profile_async(actor_url)
+            except httpx.HTTPError as e:
+                print(f"ERROR: could not get profile {actor_url}: {e}")
+                return None
+
+    return await asyncio.gather(*[fetch(actor_url) for actor_url in actor_urls])
+
+
+def refresh_member_endpoints(db, members):
+    """Resolve and store the inbox and sharedInbox of the given memberships, profiles are fetched concurrently
+
+    A member that could not be resolved is marked as tried, so it is not fetched again
+    before member_endpoints_ttl passes.
+    """
+    if len(members) == 0:
+        return
+    # Members that followed before their actor url was stored are resolved from their handle
+    handles = [member.member.name for member in members if member.actor_url is None]
+    resolved = resolve_many(handles) if len(handles) > 0 else {}
+    actor_urls = [member.actor_url if member.actor_url is not None else resolved[member.member.name]
+                  for member in members]
+
+    to_fetch = [actor_url for actor_url in dict.fromkeys(actor_urls) if actor_url is not None]
+    profiles = dict(zip(to_fetch, http_client.run(_fetch_profiles_async(to_fetch))))
+
+    for member, actor_url in zip(members, actor_urls):
+        if actor_url is None:
+            print(f"ERROR: could not resolve member: {member.member.name}")
+            mark_member_endpoints_failed(db, member)
+            continue
+        profile = profiles.get(actor_url, None)
+        if profile is None:
+            print(f"ERROR: could not get profile of member: {member.member.name}")
+            mark_member_endpoints_failed(db, member)
+            continue
+        update_member_endpoints(db, member, actor_url, inbox_from_profile(profile), shared_inbox_from_profile(profile))
+    db.commit()
+
+
+def refresh_stale_member_endpoints(db, group_id: int) -> int:
+    """Refresh the inboxes of the members of a group stored more than member_endpoints_ttl ago
+
+    Returns:
+        int: How many memberships were refreshed
+    """
+    older_than = datetime.utcnow() - timedelta(seconds=MEMBER_ENDPOINTS_TTL)
+    members = get_members_needing_endpoints(db, group_id, older_than)
+    refresh_member_endpoints(db, members)
+    return len(members)
 
     
-def send_signed_multi(activity, inboxes, preshared_key_id, key_path):
-    # TODO: Make this a worker
-    for inbox in inboxes:
-        print("Sending to: " + str(inbox))
-        send_signed(inbox, activity, preshared_key_id, key_path)    
+def send_signed_multi(db, activity, inboxes, preshared_key_id, key_path):
+    """Queue the activity for delivery, the delivery workers send it"""
+    print(f"Queueing {activity['id']} to {len(inboxes)} inboxes")
+    enqueue_delivery(db, activity, inboxes, preshared_key_id, key_path)
     return
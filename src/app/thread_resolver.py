@@ -0,0 +1,78 @@
+"""Resolve the ancestors of a reply
+
+Walks the inReplyTo chain of a note up to the first ancestor we already store, within
+a fetch budget and an overall deadline, so a reply to a deep or slow thread can not
+hold up the boost. Objects are read through the remote object store, a thread with
+several replies is only fetched once. The authors of all ancestors are then fetched
+concurrently, and the caller inserts every missing ancestor in one transaction.
+"""
+import asyncio
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlmodel import select, Session
+
+from app import http_client
+from app.common import get_config
+from app.db import Boost
+from app.get_federated_data import get_profile_async
+from app.remote_objects import get_object, is_cached
+
+config = get_config()
+THREADS_CONFIG = config.get("threads", None) or {}
+
+MAX_ANCESTORS = THREADS_CONFIG.get("max_ancestors", 10)
+# Network fetches allowed while resolving one note
+FETCH_BUDGET = THREADS_CONFIG.get("fetch_budget", 10)
+# Seconds allowed for resolving one note, ancestors not reached by then are left out
+DEADLINE = THREADS_CONFIG.get("deadline", 10)
+
+
+def resolve_ancestors(db: Session, in_reply_to: Optional[str]) -> Tuple[Optional[Boost], List[Tuple[str, Dict[str, Any]]]]:
+    """Walk up an inReplyTo chain until an ancestor we already store
+
+    Args:
+        db (Session): the db session
+        in_reply_to (Optional[str]): The inReplyTo of the note being stored
+
+    Returns:
+        Tuple[Optional[Boost], List[Tuple[str, Dict[str, Any]]]]: The stored ancestor the chain ends on, None if
+            it was not reached, and the url and object of each missing ancestor from the closest to the furthest
+    """
+    deadline = time.monotonic() + DEADLINE
+    ancestors = []
+    fetches = 0
+    seen = set()
+    url = in_reply_to
+    while url is not None and url not in seen:
+        seen.add(url)
+        existing = db.exec(select(Boost).where(Boost.note_id == url)).first()
+        if existing is not None:
+            return existing, ancestors
+
+        if len(ancestors) >= MAX_ANCESTORS:
+            break
+        remaining = deadline - time.monotonic()
+        if not is_cached(url):
+            if fetches >= FETCH_BUDGET or remaining <= 0:
+                print(f"Thread budget used up at {url}")
+                break
+            fetches += 1
+        data = get_object(url, timeout=max(remaining, 0.1))
+        if data is None or "attributedTo" not in data:
+            break
+
+        ancestors.append((url, data))
+        url = data.get("inReplyTo", None)
+    return None, ancestors
+
+
+async def _prefetch_profiles(actor_urls: List[str]) -> None:
+    await asyncio.gather(*[get_profile_async(actor_url) for actor_url in actor_urls], return_exceptions=True)
+
+
+def prefetch_authors(notes: List[Dict[str, Any]]) -> None:
+    """Fetch the authors of many notes concurrently so storing them does not wait on each in turn"""
+    actor_urls = list({note["attributedTo"] for note in notes if isinstance(note.get("attributedTo", None), str)})
+    if len(actor_urls) > 0:
+        http_client.run(_prefetch_profiles(actor_urls))
@@ -0,0 +1,152 @@
+"""Signature verification off the event loop
+
+RSA verification is CPU bound, running it inline on the event loop makes every other
+request wait during a burst of incoming activities. Verifications run in a pool of
+processes or threads instead. Verifications requested at about the same time are
+submitted together as one batch, so a burst costs one round trip to the pool rather
+than one per activity.
+"""
+import asyncio
+import multiprocessing
+import threading
+import weakref
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.serialization import load_pem_public_key
+
+from app.common import get_config
+from app.http_sig import verify_post_headers
+
+config = get_config()
+INBOX_CONFIG = config.get("inbox", None) or {}
+
+# "process", "thread" or "inline" to verify on the event loop as before
+VERIFY_POOL = INBOX_CONFIG.get("verify_pool", "process")
+# None uses one worker per cpu
+VERIFY_WORKERS = INBOX_CONFIG.get("verify_workers", None)
+VERIFY_BATCH_SIZE = INBOX_CONFIG.get("verify_batch_size", 32)
+# Seconds to wait for more verifications before submitting a batch
+VERIFY_BATCH_WINDOW = INBOX_CONFIG.get("verify_batch_window", 0.002)
+
+# A verification: key, headers, path, digest, body
+VerifyItem = Tuple[Any, Dict[str, str], str, str, str]
+
+_executor: Optional[Executor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> Executor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            if VERIFY_POOL == "process":
+                # Spawned, not forked: by now the http client, delivery and inbox threads are running and
+                # forking a multi-threaded process can leave the children holding locks no one releases
+                _executor = ProcessPoolExecutor(max_workers=VERIFY_WORKERS,
+                                                mp_context=multiprocessing.get_context("spawn"))
+            else:
+                _executor = ThreadPoolExecutor(max_workers=VERIFY_WORKERS, thread_name_prefix="fedigroup-verify")
+        return _executor
+
+
+@lru_cache(maxsize=1024)
+def _load_public_key(pem: str) -> Any:
+    # Keys cross the process boundary as pem, load each one once per worker process
+    return load_pem_public_key(pem.encode('utf-8'), backend=default_backend())
+
+
+def _verify_one(key: Any, headers: Dict[str, str], path: str, digest: str, body: str) -> bool:
+    try:
+        if isinstance(key, str):
+            key = _load_public_key(key)
+        return verify_post_headers("", key, headers, path, False, digest, body, False)
+    except Exception as e:
+        print(f"Error verifying signature: {e}")
+        return False
+
+
+def _verify_batch(items: List[VerifyItem]) -> List[bool]:
+    return [_verify_one(*item) for item in items]
+
+
+class _Batcher:
+    """Collects verifications requested on one event loop and submits them to the pool together"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._loop = loop
+        self._items: List[VerifyItem] = []
+        self._futures: List[asyncio.Future] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+
+    def submit(self, item: VerifyItem) -> asyncio.Future:
+        future = self._loop.create_future()
+        self._items.append(item)
+        self._futures.append(future)
+        if len(self._items) >= VERIFY_BATCH_SIZE:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = self._loop.call_later(VERIFY_BATCH_WINDOW, self._flush)
+        return future
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        items, futures = self._items, self._futures
+        self._items, self._futures = [], []
+        if len(items) == 0:
+            return
+
+        def done(pool_future: asyncio.Future) -> None:
+            error = pool_future.exception()
+            for i, future in enumerate(futures):
+                if future.done():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(pool_future.result()[i])
+
+        self._loop.run_in_executor(get_executor(), _verify_batch, items).add_done_callback(done)
+
+
+# One batcher per event loop, the inbox processors each run their own
+_batchers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _Batcher]" = weakref.WeakKeyDictionary()
+
+
+async def verify_signature(public_key_pem: str, public_key: Any, headers: Dict[str, str], path: str,
+                           digest: str, body: str) -> bool:
+    """Verify the signature of a POST in the verification pool
+
+    Args:
+        public_key_pem (str): The key as pem, sent to worker processes
+        public_key (Any): The loaded key, used by threads and inline
+        headers (Dict[str, str]): The request headers
+        path (str): The path the request was posted to
+        digest (str): The Digest header, check it against the body first with digest_matches_body
+        body (str): The request body
+
+    Returns:
+        bool: True if the signature is valid
+    """
+    if VERIFY_POOL == "inline":
+        return _verify_one(public_key, headers, path, digest, body)
+
+    key = public_key_pem if VERIFY_POOL == "process" else public_key
+    loop = asyncio.get_running_loop()
+    batcher = _batchers.get(loop, None)
+    if batcher is None:
+        batcher = _Batcher(loop)
+        _batchers[loop] = batcher
+    return await batcher.submit((key, headers, path, digest, body))
+
+
+def close() -> None:
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+            _executor = None
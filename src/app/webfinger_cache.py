@@ -0,0 +1,182 @@
+"""Cache of webfinger lookups from handle (user@server) to actor url
+
+Resolved handles are kept for webfinger_ttl, handles the server says do not exist (404,
+410 or no self link) are kept for the shorter webfinger_negative_ttl. Timeouts and 5xx
+responses are not cached, so a server that is briefly down is asked again next time.
+Entries live in the webfinger_cache table so they survive restarts.
+"""
+import asyncio
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import httpx
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import select
+
+from app import http_client
+from app.cache import TTLCache
+from app.common import get_config, get_group_path, SERVER_DOMAIN
+from app.db import SessionLocal, WebfingerCache
+
+config = get_config()
+CACHE_CONFIG = config.get("cache", None) or {}
+
+WEBFINGER_TTL = CACHE_CONFIG.get("webfinger_ttl", 86400)
+WEBFINGER_NEGATIVE_TTL = CACHE_CONFIG.get("webfinger_negative_ttl", 600)
+WEBFINGER_MEMORY_SIZE = CACHE_CONFIG.get("webfinger_memory_size", 10000)
+WEBFINGER_CONCURRENCY = CACHE_CONFIG.get("webfinger_concurrency", 20)
+
+# Values are stored as a 1-tuple so a cached miss (None) can be told apart from no entry
+_memory = TTLCache(WEBFINGER_MEMORY_SIZE, WEBFINGER_TTL)
+
+# Statuses that mean the handle does not exist, anything else failing may be transient
+DEFINITIVE_MISS_STATUSES = (404, 410)
+
+
+def normalize_handle(actor_handle: str) -> str:
+    # Remove proceeding @ if needed
+    if actor_handle.startswith("@"):
+        actor_handle = actor_handle[1:]
+    return actor_handle.lower()
+
+
+def actor_url_from_webfinger(data) -> Optional[str]:
+    if not isinstance(data, dict):
+        return None
+    for link in data.get("links", []):
+        if type(link) == dict and "rel" in link.keys() and "type" in link.keys() and "href" in link.keys():
+            if link["rel"] == "self" and link["type"] == "application/activity+json":
+                return link["href"]
+    return None
+
+
+def _local_actor_url(actor_handle: str) -> Optional[str]:
+    user, host = actor_handle.split("@", 1)
+    if host == SERVER_DOMAIN:
+        return get_group_path(user)
+    return None
+
+
+async def _lookup_async(actor_handle: str, semaphore: asyncio.Semaphore) -> Tuple[Optional[str], bool]:
+    """Returns the actor url and whether the answer can be cached"""
+    host = actor_handle.split("@", 1)[1]
+    url = "https://" + host + "/.well-known/webfinger?resource=acct:" + actor_handle
+    print("Getting: " + str(url))
+    async with semaphore:
+        try:
+            r = await http_client.get_async(url)
+        except httpx.HTTPError as e:
+            print(f"Error, failed to get webfinger: {url} {e}")
+            return None, False
+    if r.status_code in DEFINITIVE_MISS_STATUSES:
+        return None, True
+    if r.status_code >= 400:
+        print(f"Error, failed to get webfinger: {url} status {r.status_code}")
+        return None, False
+    try:
+        return actor_url_from_webfinger(r.json()), True
+    except ValueError:
+        print("Error, failed to decode webfinger: " + str(url))
+    return None, False
+
+
+async def _lookup_many_async(handles: List[str]) -> Dict[str, Tuple[Optional[str], bool]]:
+    semaphore = asyncio.Semaphore(WEBFINGER_CONCURRENCY)
+    results = await asyncio.gather(*[_lookup_async(handle, semaphore) for handle in handles])
+    return dict(zip(handles, results))
+
+
+def _remember(handle: str, actor_url: Optional[str], ttl: float) -> None:
+    _memory.set(handle, (actor_url,), ttl)
+
+
+def _store(db, resolved: Dict[str, Optional[str]]) -> None:
+    now = datetime.utcnow()
+    rows = []
+    for handle, actor_url in resolved.items():
+        ttl = WEBFINGER_TTL if actor_url is not None else WEBFINGER_NEGATIVE_TTL
+        rows.append({
+            "handle": handle,
+            "actor_url": actor_url,
+            "fetched_at": now,
+            "expires_at": now + timedelta(seconds=ttl),
+        })
+        _remember(handle, actor_url, ttl)
+    if len(rows) == 0:
+        return
+    statement = insert(WebfingerCache).values(rows)
+    statement = statement.on_conflict_do_update(
+        index_elements=[WebfingerCache.handle],
+        set_={
+            "actor_url": statement.excluded.actor_url,
+            "fetched_at": statement.excluded.fetched_at,
+            "expires_at": statement.excluded.expires_at,
+        },
+    )
+    db.execute(statement)
+    db.commit()
+
+
+def resolve_many(actor_handles: Iterable[str]) -> Dict[str, Optional[str]]:
+    """Resolves many handles to actor urls at once
+
+    Cached handles are answered from memory or with a single query, the rest are looked
+    up concurrently.
+
+    Args:
+        actor_handles (Iterable[str]): Handles in the user@server format
+
+    Returns:
+        Dict[str, Optional[str]]: The actor url of each given handle, None if it did not resolve
+    """
+    result = {}
+    missing = []
+    for actor_handle in actor_handles:
+        handle = normalize_handle(actor_handle)
+        if "@" not in handle:
+            print("actor handle has no @")
+            result[actor_handle] = None
+            continue
+
+        local_url = _local_actor_url(handle)
+        if local_url is not None:
+            result[actor_handle] = local_url
+            continue
+
+        cached = _memory.get(handle)
+        if cached is not None:
+            result[actor_handle] = cached[0]
+            continue
+        missing.append((actor_handle, handle))
+
+    if len(missing) == 0:
+        return result
+
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        missing_handles = list({handle for _, handle in missing})
+        rows = db.exec(select(WebfingerCache)
+                       .where(WebfingerCache.handle.in_(missing_handles))
+                       .where(WebfingerCache.expires_at > now)).all()
+        resolved = {}
+        for row in rows:
+            resolved[row.handle] = row.actor_url
+            _remember(row.handle, row.actor_url, (row.expires_at - now).total_seconds())
+
+        to_lookup = [handle for handle in missing_handles if handle not in resolved]
+        if len(to_lookup) > 0:
+            looked_up = http_client.run(_lookup_many_async(to_lookup))
+            _store(db, {handle: actor_url for handle, (actor_url, cacheable) in looked_up.items() if cacheable})
+            resolved.update({handle: actor_url for handle, (actor_url, _) in looked_up.items()})
+    finally:
+        db.close()
+
+    for actor_handle, handle in missing:
+        result[actor_handle] = resolved.get(handle, None)
+    return result
+
+
+def resolve(actor_handle: str) -> Optional[str]:
+    """Resolves a single handle to its actor url, None if it did not resolve"""
+    return resolve_many([actor_handle])[actor_handle]
@@ -1,6 +1,7 @@
 from logging.config import fileConfig
 from app.db import Setting, Group, Members, Announces, NoteRecipients, BoostRecipients, Actor, Note, Boost, Tag, NoteTags, \
-OauthApp, OauthCode
+OauthApp, OauthCode, RemoteActor, WebfingerCache, \
+OutboxActivity, Delivery, InboxJournal, SeenActivity, RemoteObject, HomeTimeline
 
 from sqlalchemy import engine_from_config
 from sqlalchemy import pool
@@ -0,0 +1,45 @@
+"""Add indexes for hot lookups
+
+Revision ID: adfd4d1893c5
+Revises: a8df2267f84f
+Create Date: 2026-10-18 16:51:08.254319
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'adfd4d1893c5'
+down_revision = 'a8df2267f84f'
+branch_labels = None
+depends_on = None
+
+# name, table, columns, unique
+INDEXES = [
+    ('ix_groups_members_group_id_member_id', 'groups_members', ['group_id', 'member_id'], True),
+    ('ix_groups_members_member_id', 'groups_members', ['member_id'], False),
+    ('ix_boosts_note_id', 'boosts', ['note_id'], False),
+    ('ix_boosts_group_id_created_at', 'boosts', ['group_id', 'created_at'], False),
+    ('ix_boosts_in_reply_to_id', 'boosts', ['in_reply_to_id'], False),
+    ('ix_notes_recipients_note_id', 'notes_recipients', ['note_id'], False),
+    ('ix_boosts_recipients_boost_id', 'boosts_recipients', ['boost_id'], False),
+]
+
+
+def upgrade() -> None:
+    # Duplicate memberships would block the unique index, keep the oldest of each
+    op.execute(
+        "DELETE FROM groups_members a USING groups_members b "
+        "WHERE a.group_id = b.group_id AND a.member_id = b.member_id AND a.id > b.id"
+    )
+
+    # Built concurrently so a live instance keeps taking writes, this can not run in a transaction
+    with op.get_context().autocommit_block():
+        for name, table, columns, unique in INDEXES:
+            op.create_index(name, table, columns, unique=unique, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, columns, unique in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
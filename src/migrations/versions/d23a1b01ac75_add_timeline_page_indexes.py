@@ -0,0 +1,30 @@
+"""Add timeline page indexes
+
+Revision ID: d23a1b01ac75
+Revises: 871aa8b30aaf
+Create Date: 2026-10-18 18:05:17.924683
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd23a1b01ac75'
+down_revision = '871aa8b30aaf'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index('ix_boosts_roots_group_id_created_at_id', 'boosts', ['group_id', 'created_at', 'id'], unique=False,
+                        postgresql_where=sa.text('in_reply_to_id IS NULL'), postgresql_concurrently=True)
+        op.create_index('ix_boosts_roots_created_at_id', 'boosts', ['created_at', 'id'], unique=False,
+                        postgresql_where=sa.text('in_reply_to_id IS NULL'), postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_boosts_roots_created_at_id', table_name='boosts', postgresql_concurrently=True)
+        op.drop_index('ix_boosts_roots_group_id_created_at_id', table_name='boosts', postgresql_concurrently=True)
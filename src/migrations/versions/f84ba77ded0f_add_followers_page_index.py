@@ -0,0 +1,25 @@
+"""Add followers page index
+
+Revision ID: f84ba77ded0f
+Revises: 8ca6901995c7
+Create Date: 2026-10-18 19:48:06.215839
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'f84ba77ded0f'
+down_revision = '8ca6901995c7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index('ix_groups_members_group_id_id', 'groups_members', ['group_id', 'id'], unique=False, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_groups_members_group_id_id', table_name='groups_members', postgresql_concurrently=True)